@@ -0,0 +1,65 @@
+"""
+Measures JSON serialization CPU time and bytes on the wire for typical response payloads.
+
+Usage: python benchmarks/serialization.py
+"""
+import gzip
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(BASE_DIR / "src"))
+
+def typical_payloads():
+    """Builds payloads shaped like the /read-file, /read-logs, /run-command and /check-process-status responses."""
+    source = "\n".join(p.read_text(encoding="utf-8") for p in sorted((BASE_DIR / "src").glob("*.py")))
+    log_line = "2025-03-12 10:15:42,123 - system - INFO - Executed command: ls -la | Output: total 48 drwxr-xr-x 5 user staff 160 → ok\n"
+    return {
+        "read-file 1MB": {"file": "/srv/project/app.py", "content": (source * (1_000_000 // len(source) + 1))[:1_000_000]},
+        "read-logs 5MB": {"logs": (log_line * (5_000_000 // len(log_line) + 1))[:5_000_000]},
+        "run-command 200KB": {"input": "find / -name '*.py'", "output": "\n".join(f"/usr/lib/python3/site-packages/pkg_{i}/module_{i}.py" for i in range(4000)), "error": ""},
+        "check-process-status 2MB": {"message": "Process is still running", "log": os.urandom(1_000_000).hex(), "completed": False},
+        "list 500 processes": {"processes": [{"process_id": f"{i:08d}-0000-4000-8000-000000000000", "status": "running"} for i in range(500)]},
+    }
+
+def timed(fn, payload, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(payload)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def stdlib_dumps(payload):
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def main():
+    serializers = {"json": stdlib_dumps}
+    if orjson is not None:
+        serializers["orjson"] = orjson.dumps
+    print(f"{'payload':<26}{'serializer':<10}{'ms':>9}{'raw KB':>10}{'gzip KB':>10}{'gzip ms':>9}{'br KB':>10}{'br ms':>9}")
+    for (name, payload) in typical_payloads().items():
+        for (serializer, dumps) in serializers.items():
+            seconds, body = timed(dumps, payload)
+            gzip_seconds, gzipped = timed(lambda data: gzip.compress(data, 6), body, repeat=2)
+            row = f"{name:<26}{serializer:<10}{seconds * 1000:>9.2f}{len(body) / 1024:>10.1f}{len(gzipped) / 1024:>10.1f}{gzip_seconds * 1000:>9.2f}"
+            if brotli is not None:
+                br_seconds, compressed = timed(lambda data: brotli.compress(data, quality=4), body, repeat=2)
+                row += f"{len(compressed) / 1024:>10.1f}{br_seconds * 1000:>9.2f}"
+            print(row)
+
+if __name__ == "__main__":
+    main()
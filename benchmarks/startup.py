@@ -0,0 +1,60 @@
+"""
+Measures how long `import main` takes and how much memory it holds, the cost paid on every
+boot and every /restart-server.
+
+Usage: python benchmarks/startup.py [--runs 5] [--max-ms 1500] [--max-rss-mb 150]
+Exits non-zero when a budget is exceeded, so it can guard against startup regressions.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+HEAVY_MODULES = ("cv2", "numpy", "mss", "PIL", "pytesseract")
+
+PROBE = f"""
+import json, resource, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == "darwin":
+    rss_kb //= 1024
+print(json.dumps({{"import_ms": elapsed * 1000, "rss_mb": rss_kb / 1024, "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+def measure(runs: int):
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", PROBE], cwd=SRC_DIR, capture_output=True, text=True, check=True)
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if the median import time exceeds this")
+    parser.add_argument("--max-rss-mb", type=float, default=None, help="fail if the median peak RSS exceeds this")
+    args = parser.parse_args()
+
+    samples = measure(args.runs)
+    import_ms = statistics.median(s["import_ms"] for s in samples)
+    rss_mb = statistics.median(s["rss_mb"] for s in samples)
+    heavy = sorted({m for s in samples for m in s["heavy"]})
+    print(f"import main: median {import_ms:.1f} ms over {args.runs} runs, peak RSS {rss_mb:.1f} MB")
+    print(f"heavy vision modules loaded at import: {', '.join(heavy) or 'none'}")
+
+    failed = False
+    if args.max_ms is not None and import_ms > args.max_ms:
+        print(f"FAIL: import time {import_ms:.1f} ms exceeds budget {args.max_ms} ms")
+        failed = True
+    if args.max_rss_mb is not None and rss_mb > args.max_rss_mb:
+        print(f"FAIL: peak RSS {rss_mb:.1f} MB exceeds budget {args.max_rss_mb} MB")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Compares N small API calls made as separate HTTPS requests (a new connection each, like the
+agent's tool calls through the tunnel) with the same calls multiplexed over one /ws connection.
+
+Usage: python benchmarks/websocket_rpc.py --url https://host[:port] --api-key KEY [--calls 50] [--path /get-current-directory]
+Needs httpx and websockets (pip install httpx websockets).
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+import websockets
+
+async def over_http(url: str, api_key: str, path: str, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        async with httpx.AsyncClient(base_url=url) as client:
+            response = await client.post(path, headers={"Authorization": f"Bearer {api_key}"})
+            response.raise_for_status()
+    return time.perf_counter() - start
+
+async def over_websocket(url: str, api_key: str, path: str, calls: int) -> float:
+    ws_url = url.replace("https://", "wss://").replace("http://", "ws://") + "/ws"
+    start = time.perf_counter()
+    async with websockets.connect(ws_url, additional_headers={"Authorization": f"Bearer {api_key}"}) as ws:
+        for request_id in range(calls):
+            await ws.send(json.dumps({"id": request_id, "path": path}))
+        pending = set(range(calls))
+        while pending:
+            frame = json.loads(await ws.recv())
+            if frame.get("status", 200) >= 400:
+                raise RuntimeError(frame)
+            pending.discard(frame["id"])
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://127.0.0.1:3000")
+    parser.add_argument("--api-key", required=True)
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--path", default="/get-current-directory")
+    args = parser.parse_args()
+
+    http_s = asyncio.run(over_http(args.url, args.api_key, args.path, args.calls))
+    ws_s = asyncio.run(over_websocket(args.url, args.api_key, args.path, args.calls))
+    print(f"{args.calls} x {args.path}")
+    print(f"  HTTP, one connection per call: {http_s * 1000:8.1f} ms total, {http_s / args.calls * 1000:6.2f} ms/call")
+    print(f"  WebSocket, multiplexed:        {ws_s * 1000:8.1f} ms total, {ws_s / args.calls * 1000:6.2f} ms/call")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,26 @@
-from fastapi import Request, HTTPException
+from fastapi import Request, HTTPException, WebSocket, status
 import os
+from timing import span
 
 def authenticate_request(request: Request):
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Unauthorized. Use 'Authorization: Bearer <API_KEY>'")
+    with span("auth"):
+        auth_header = request.headers.get("Authorization")
+        if not auth_header or not auth_header.startswith("Bearer "):
+            raise HTTPException(status_code=401, detail="Unauthorized. Use 'Authorization: Bearer <API_KEY>'")
 
-    api_key = auth_header.split(" ")[1]
-    if api_key != os.getenv("API_KEY"):
-        raise HTTPException(status_code=403, detail="Invalid API Key")
+        api_key = auth_header.split(" ")[1]
+        if api_key != os.getenv("API_KEY"):
+            raise HTTPException(status_code=403, detail="Invalid API Key")
+
+async def authenticate_websocket(websocket: WebSocket):
+    """
+    Checks the 'Authorization: Bearer <API_KEY>' header of a WebSocket handshake. The key is never
+    accepted in the query string, which uvicorn writes to its access log.
+    Rejects the handshake and returns None when it is missing or invalid; returns the API key otherwise.
+    """
+    auth_header = websocket.headers.get("Authorization", "")
+    api_key = auth_header.split(" ")[1] if auth_header.startswith("Bearer ") else None
+    if not api_key or api_key != os.getenv("API_KEY"):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid API Key")
+        return None
+    return api_key
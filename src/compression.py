@@ -0,0 +1,157 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript", "application/xml")
+UNBUFFERED_TYPES = ("text/event-stream",)
+
+def negotiate_encoding(accept_encoding: str, encodings=("br", "gzip")):
+    """
+    Picks the first server-preferred encoding the client accepts with a non-zero q-value.
+    """
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in encodings:
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+class StreamCompressor:
+    """Incremental gzip/brotli compressor that can flush after every streamed chunk."""
+
+    def __init__(self, encoding: str, gzip_level: int = 6, brotli_quality: int = 4):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses JSON/text responses with brotli or gzip,
+    negotiated from the request's Accept-Encoding header.
+    Bodies smaller than minimum_size, binary payloads, range-capable file downloads
+    and event streams are passed through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, encodings=("br", "gzip"), gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = tuple(encodings)
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = ""
+        for (name, value) in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+                break
+        encoding = negotiate_encoding(accept_encoding, self.encodings) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressionResponder(self, encoding, send).run(scope, receive)
+
+class _CompressionResponder:
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start_message = None
+        self.eligible = False
+        self.compressor = None
+
+    async def run(self, scope, receive):
+        await self.middleware.app(scope, receive, self.send_wrapper)
+
+    def _is_eligible(self, message) -> bool:
+        if message["status"] in (204, 206, 304):
+            return False
+        content_type = ""
+        for (name, value) in message.get("headers", []):
+            if name in (b"content-encoding", b"content-range", b"accept-ranges"):
+                return False
+            if name == b"content-type":
+                content_type = value.decode("latin-1").lower()
+        if content_type.startswith(UNBUFFERED_TYPES):
+            return False
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def _compressed_start(self, start_message, content_length: int | None):
+        headers = [(name, value) for (name, value) in start_message.get("headers", []) if name != b"content-length"]
+        headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        headers.append((b"vary", b"Accept-Encoding"))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode("latin-1")))
+        return {**start_message, "headers": headers}
+
+    async def send_wrapper(self, message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            self.eligible = self._is_eligible(message)
+            return
+        if message["type"] != "http.response.body":
+            if self.start_message is not None:
+                # pathsend/zerocopysend and other extensions are forwarded uncompressed.
+                start_message, self.start_message = self.start_message, None
+                self.eligible = False
+                await self.send(start_message)
+            await self.send(message)
+            return
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start_message is not None:
+            start_message, self.start_message = self.start_message, None
+            if not self.eligible or (not more_body and len(body) < self.middleware.minimum_size):
+                await self.send(start_message)
+                self.eligible = False
+                await self.send(message)
+                return
+            self.compressor = StreamCompressor(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+            if not more_body:
+                compressed = self.compressor.compress(body) + self.compressor.finish()
+                await self.send(self._compressed_start(start_message, len(compressed)))
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+            await self.send(self._compressed_start(start_message, None))
+        elif not self.eligible:
+            await self.send(message)
+            return
+        if more_body:
+            chunk = self.compressor.compress(body) + self.compressor.flush()
+        else:
+            chunk = self.compressor.compress(body) + self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
@@ -1,13 +1,25 @@
+import re
 import dotenv
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from utils import (
     read_file, write_file, append_file, replace_func, replace_text,
-    read_lines as utils_read_lines, read_logs, read_func
+    read_lines as utils_read_lines, read_logs, read_func, resolve_path, write_stream, peek_etag
 )
 from schemas import (
     WriteFileRequest, AppendFileRequest, ReadFileRequest, ReadLinesRequest,
-    ReplaceFunctionRequest, ReplaceTextRequest, ReadFuncRequest
+    ReplaceFunctionRequest, ReplaceTextRequest, ReadFuncRequest, SearchRequest
 )
+from search import SearchJob, compile_pattern, stream_search
+import search_index
+
+try:
+    from python_multipart.exceptions import FormParserError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.exceptions import FormParserError
+    from multipart.multipart import MultipartParser, parse_options_header
 
 router = APIRouter()
 
@@ -31,14 +43,30 @@ async def replace_text_endpoint(req: ReplaceTextRequest):
         raise HTTPException(status_code=400, detail=result["error"])
     return result
 
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires: W/ prefixes are ignored on both sides."""
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
 @router.post("/read-file")
-async def get_file(request: ReadFileRequest):
+async def get_file(request: ReadFileRequest, response: Response, if_none_match: Optional[str] = Header(None)):
     """
     Reads the content of the specified file.
-    """
+    The response carries an ETag (content hash, or stat-based for large files); send it back as
+    If-None-Match (or if_none_match in the body) and an unchanged file returns 304 Not Modified
+    without its content. Cached and large files are checked before anything is read.
+    """
+    condition = if_none_match or request.if_none_match
+    if condition:
+        etag = peek_etag(request.filepath)
+        if etag and etag_matches(condition, etag):
+            return Response(status_code=304, headers={"ETag": etag})
     result = await read_file(request.filepath)
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
+    if condition and etag_matches(condition, result["etag"]):
+        return Response(status_code=304, headers={"ETag": result["etag"]})
+    response.headers["ETag"] = result["etag"]
     return result
 
 @router.post("/write-file")
@@ -90,3 +118,120 @@ async def read_function(request: ReadFuncRequest):
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
     return result
+
+@router.post("/search")
+async def search_files(request: SearchRequest):
+    """
+    Searches files under a directory for a literal or regex pattern, honoring .gitignore files.
+    Inside SEARCH_INDEX_ROOT only files the trigram index reports as candidates are scanned, unless
+    use_index is false. Files changed outside the API are only seen by the index after its next refresh,
+    so the summary line reports whether the index was used and its age in seconds.
+    Streams newline-delimited JSON matches ({path, line, column, text}) followed by a summary line.
+    """
+    root = resolve_path(request.path)
+    if not root.exists():
+        raise HTTPException(status_code=404, detail="Path not found")
+    try:
+        compiled = compile_pattern(request.pattern, request.regex, request.case_sensitive)
+    except re.error as e:
+        raise HTTPException(status_code=400, detail=f"Invalid pattern: {e}")
+    candidates = None
+    if request.use_index and request.use_gitignore and root.is_dir():
+        candidates = await search_index.find_candidates(str(root), request.pattern, request.regex)
+    job = SearchJob(
+        str(root), compiled, include=request.include, exclude=request.exclude,
+        max_results=request.max_results, max_matches_per_file=request.max_matches_per_file,
+        max_filesize=request.max_filesize, use_gitignore=request.use_gitignore, candidates=candidates,
+        index_age=search_index.index_age() if candidates is not None else None
+    )
+    return StreamingResponse(stream_search(job, request.pattern), media_type="application/x-ndjson")
+
+async def iter_multipart_file(request: Request, boundary: bytes):
+    """
+    Parses a multipart body as it arrives and yields the content of its first file field, so the
+    upload is written to disk once instead of first being spooled to a temporary file by request.form().
+    Yields b"" when the file field starts, which tells an empty file apart from a missing one.
+    """
+    part = {"headers": {}, "field": b"", "value": b"", "is_file": False, "found": False, "done": False}
+    pieces = []
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"] = part["value"] = b""
+
+    def on_headers_finished():
+        (_, options) = parse_options_header(part["headers"].pop(b"content-disposition", b""))
+        part["headers"] = {}
+        part["is_file"] = not part["found"] and b"filename" in options
+        if part["is_file"]:
+            part["found"] = True
+            pieces.append(b"")
+
+    def on_part_data(data, start, end):
+        if part["is_file"]:
+            pieces.append(bytes(data[start:end]))
+
+    def on_part_end():
+        if part["is_file"]:
+            part["is_file"] = False
+            part["done"] = True
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field, "on_header_value": on_header_value, "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished, "on_part_data": on_part_data, "on_part_end": on_part_end,
+    })
+    async for chunk in request.stream():
+        parser.write(chunk)
+        ready = pieces[:]
+        pieces.clear()
+        for piece in ready:
+            yield piece
+        if part["done"]:
+            return
+    parser.finalize()
+    if part["found"] and not part["done"]:
+        raise FormParserError("Multipart upload ended before the file was complete")
+
+@router.post("/upload-file")
+async def upload_file(request: Request, filepath: str, append: bool = False):
+    """
+    Uploads a file (text or binary) by streaming it to disk in chunks.
+    Send the raw bytes as the request body, or a multipart form with a file field (the first one is used).
+    A malformed or truncated multipart body is rejected with 400 and leaves the target file untouched.
+    """
+    (content_type, options) = parse_options_header(request.headers.get("content-type", ""))
+    if content_type == b"multipart/form-data":
+        if not options.get(b"boundary"):
+            raise HTTPException(status_code=400, detail="Multipart upload without a boundary")
+        chunks = iter_multipart_file(request, options[b"boundary"])
+        try:
+            found = await anext(chunks, None) is not None
+        except FormParserError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid multipart upload: {e}")
+        if not found:
+            raise HTTPException(status_code=400, detail="No file field in multipart upload")
+        try:
+            result = await write_stream(filepath, chunks, append)
+        except FormParserError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid multipart upload: {e}")
+    else:
+        result = await write_stream(filepath, request.stream(), append)
+    if "error" in result:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
+@router.api_route("/download-file", methods=["GET", "HEAD"])
+async def download_file(filepath: str):
+    """
+    Downloads a file (text or binary) straight from disk, with HTTP Range support for partial
+    and resumed transfers. The file is never loaded into memory as a whole.
+    """
+    resolved_path = resolve_path(filepath)
+    if not resolved_path.is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+    return FileResponse(resolved_path, filename=resolved_path.name)
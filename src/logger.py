@@ -7,7 +7,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 LOG_DIR = BASE_DIR / 'logs'
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
-def setup_logger(name: str, log_file: str, level: str='INFO'):
+def setup_logger(name: str, log_file: str, level: str='INFO', fmt: str='%(asctime)s - %(name)s - %(levelname)s - %(message)s', console: bool=True):
     logger = logging.getLogger(name)
     if not logger.hasHandlers():
         log_queue = deque(maxlen=20)
@@ -18,7 +18,7 @@ def setup_logger(name: str, log_file: str, level: str='INFO'):
                 log_queue.append(self.format(record))
         file_path = LOG_DIR / log_file
         file_handler = TimedRotatingFileHandler(str(file_path), when='midnight', interval=1, backupCount=1, encoding='utf-8')
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        formatter = logging.Formatter(fmt)
         file_handler.setFormatter(formatter)
         console_handler = logging.StreamHandler()
         console_formatter = logging.Formatter('%(levelname)s - %(message)s')
@@ -26,7 +26,8 @@ def setup_logger(name: str, log_file: str, level: str='INFO'):
         memory_handler = MemoryHandler()
         memory_handler.setFormatter(formatter)
         logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        if console:
+            logger.addHandler(console_handler)
         logger.addHandler(memory_handler)
         logger.setLevel(level)
         logger.propagate = False
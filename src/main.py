@@ -1,5 +1,5 @@
-from fastapi.responses import JSONResponse
-import uuid, dotenv, uvicorn, json, os, sys, asyncio
+from fastapi.responses import JSONResponse, Response
+import uuid, dotenv, uvicorn, json, os, sys, asyncio, hashlib, glob, signal, socket, subprocess, threading, time
 from contextlib import asynccontextmanager
 from fastapi.requests import Request
 from fastapi import FastAPI, Depends, HTTPException
@@ -8,8 +8,16 @@ from logger import system_logger
 from docs_router import router as docs
 from vision_router import router as vision
 from info_router import router as info
-from system_router import cleanup_processes, router as system
+from system_router import adopt_orphaned_processes_loop, cleanup_processes, sync_working_directory, router as system
+import process_store
+import search_index
+import watcher
 from file_handler import router as file
+from ws_router import router as ws
+from watch_router import router as watch
+from responses import get_response_class
+from compression import CompressionMiddleware
+from timing import TimingMiddleware
 
 logger = system_logger
 ENV_PATH = dotenv_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env')
@@ -17,62 +25,135 @@ ENV_PATH = dotenv_path = os.path.join(os.path.dirname(os.path.dirname(__file__))
 env = dotenv.load_dotenv(ENV_PATH)
 DEFAULT_HOST = '0.0.0.0'
 DEFAULT_PORT = '3000'
+DEFAULT_WORKERS = '1'
+'graceful: hand the listening socket to a new server and drain; exec: replace the process in place'
+DEFAULT_RESTART_MODE = 'graceful'
+DEFAULT_DRAIN_TIMEOUT = '30'
+RESTART_POLL_INTERVAL = 0.5
 'Runs the Uvicorn server on the externally accessible port.'
 API_KEY = dotenv.get_key(ENV_PATH, 'API_KEY')
 'Generate API Key if not found'
 if not API_KEY:
     API_KEY = str(uuid.uuid4())
     dotenv.set_key(ENV_PATH, 'API_KEY', API_KEY)
+'Response serialization and compression settings (set COMPRESSION_ENCODINGS empty to disable compression)'
+JSON_SERIALIZER = os.getenv('JSON_SERIALIZER', 'orjson')
+COMPRESSION_ENCODINGS = [e.strip() for e in os.getenv('COMPRESSION_ENCODINGS', 'br,gzip').split(',') if e.strip()]
+COMPRESSION_MINIMUM_SIZE = int(os.getenv('COMPRESSION_MINIMUM_SIZE', '1024'))
+'Vision endpoints can be disabled entirely; when enabled their heavy dependencies load on first use'
+VISION_ENABLED = os.getenv('VISION_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+'Optional trigram index that lets /search skip files that cannot match'
+SEARCH_INDEX_ROOT = os.getenv('SEARCH_INDEX_ROOT')
+SEARCH_INDEX_MAX_FILESIZE = int(os.getenv('SEARCH_INDEX_MAX_FILESIZE', str(4 * 1024 * 1024)))
+SEARCH_INDEX_REFRESH_SECONDS = float(os.getenv('SEARCH_INDEX_REFRESH_SECONDS', '30'))
+'Per-request stage timings: a Server-Timing header on every response and a sampled JSON access log (slow requests are always logged)'
+REQUEST_TIMING_ENABLED = os.getenv('REQUEST_TIMING_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv('ACCESS_LOG_SAMPLE_RATE', '0.1'))
+ACCESS_LOG_SLOW_MS = float(os.getenv('ACCESS_LOG_SLOW_MS', '500'))
+'Directories kept in a cached tree for fast listings and change events (inotify on Linux, polling elsewhere)'
+WATCH_ROOTS = [r.strip() for r in os.getenv('WATCH_ROOTS', '').split(',') if r.strip()]
+WATCH_POLL_SECONDS = float(os.getenv('WATCH_POLL_SECONDS', '2'))
+WATCH_USE_INOTIFY = os.getenv('WATCH_USE_INOTIFY', 'true').lower() not in ('0', 'false', 'no')
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage app startup and shutdown."""
     generate_openapi_json()
+    if SEARCH_INDEX_ROOT:
+        search_index.start(SEARCH_INDEX_ROOT, SEARCH_INDEX_MAX_FILESIZE, SEARCH_INDEX_REFRESH_SECONDS)
+    if WATCH_ROOTS:
+        await watcher.start(WATCH_ROOTS, WATCH_POLL_SECONDS, WATCH_USE_INOTIFY)
+    adoption_task = asyncio.create_task(adopt_orphaned_processes_loop())
     yield
     
-    cleanup_processes()
+    adoption_task.cancel()
+    watcher.stop()
+    'During a graceful restart, background processes are left running for the new server to adopt'
+    if os.getenv('SERVER_ID') and process_store.get_setting('draining_server_id') == os.getenv('SERVER_ID'):
+        logger.info('Graceful restart: leaving background processes running')
+    else:
+        cleanup_processes()
     logger.info('Shutting down server...')
 
-app = FastAPI(title='FastAPI Terminal Server', version='1.0', lifespan=lifespan)
+app = FastAPI(title='FastAPI Terminal Server', version='1.0', lifespan=lifespan, default_response_class=get_response_class(JSON_SERIALIZER), dependencies=[Depends(sync_working_directory)])
+if COMPRESSION_ENCODINGS:
+    app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE, encodings=COMPRESSION_ENCODINGS)
+if REQUEST_TIMING_ENABLED:
+    app.add_middleware(TimingMiddleware, log_sample_rate=ACCESS_LOG_SAMPLE_RATE, slow_ms=ACCESS_LOG_SLOW_MS)
 'Include routers with authentication dependency'
-app.include_router(vision, tags=['Computer Vision'], dependencies=[Depends(authenticate_request)])
+if VISION_ENABLED:
+    app.include_router(vision, tags=['Computer Vision'], dependencies=[Depends(authenticate_request)])
 app.include_router(system, tags=['System Control'], dependencies=[Depends(authenticate_request)])
 app.include_router(file, tags=['Read/Write Files'], dependencies=[Depends(authenticate_request)])
 app.include_router(info, tags=['System Information'], dependencies=[Depends(authenticate_request)])
 app.include_router(docs, tags=['Api Documentation'], dependencies=[Depends(authenticate_request)])
+app.include_router(watch, tags=['Watch'], dependencies=[Depends(authenticate_request)])
+'The WebSocket checks the API key during its handshake and forwards it to every multiplexed call'
+app.include_router(ws, tags=['WebSocket'])
 
 @app.post('/')
 async def root():
     return {'message': 'AI System Control API is running!'}
 
+def openapi_fingerprint():
+    """Hashes the stat of every source file and the settings that can change the OpenAPI schema."""
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        stat = os.stat(path)
+        digest.update(f'{os.path.basename(path)}:{stat.st_mtime_ns}:{stat.st_size};'.encode())
+    digest.update(f'{app.version}:{VISION_ENABLED}'.encode())
+    return digest.hexdigest()
+
 def generate_openapi_json():
-    openapi_schema = app.openapi()
-    openapi_schema['servers'] = [{'url': 'https://api.armand0e.online', 'description': 'Production server'}]
     parent_directory = os.path.dirname(os.path.dirname(__file__))
     openapi_path = os.path.join(parent_directory, 'openapi.json')
-    with open(openapi_path, 'w', encoding='utf-8') as f:
+    'Skip regenerating the schema when neither the routes nor the sources changed since it was last written'
+    fingerprint = openapi_fingerprint()
+    if os.path.exists(openapi_path) and process_store.get_setting('openapi_fingerprint') == fingerprint:
+        return
+    openapi_schema = app.openapi()
+    openapi_schema['servers'] = [{'url': 'https://api.armand0e.online', 'description': 'Production server'}]
+    'Write to a per-process temp file and rename so concurrent workers never leave a partial file'
+    tmp_path = f'{openapi_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
         json.dump(openapi_schema, f, indent=2)
+    os.replace(tmp_path, openapi_path)
+    process_store.set_setting('openapi_fingerprint', fingerprint)
     print(f'✅ OpenAPI schema saved at {openapi_path}')
 
 @app.get("/docs-json")
 async def read_json_file():
-    with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'openapi.json'), "r") as file:
-        data = json.load(file)
-    return JSONResponse(content=data)
+    with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'openapi.json'), "rb") as file:
+        data = file.read()
+    return Response(content=data, media_type='application/json')
+
+def can_restart_gracefully():
+    """Graceful restarts need a listening socket that can be passed to the new server."""
+    return os.name != 'nt' and bool(os.getenv('LISTEN_FD')) and bool(os.getenv('SERVER_PID'))
 
 @app.post('/restart-server')
-async def restart_server(request: Request):
-    """Endpoint to restart the API server."""
+async def restart_server(request: Request, mode: str | None = None):
+    """
+    Endpoint to restart the API server.
+    In graceful mode a new server starts on the same listening socket, the old one drains
+    its in-flight requests, and running background processes are adopted by the new server.
+    """
     auth_header = request.headers.get('Authorization')
     if not auth_header or auth_header.split(' ')[-1] != os.getenv('API_KEY'):
         raise HTTPException(status_code=403, detail='Unauthorized')
-    logger.info('Server restart requested. Cleaning up processes...')
-
-    logger.info('Cleanup completed. Restarting server...')
+    mode = (mode or os.getenv('RESTART_MODE', DEFAULT_RESTART_MODE)).lower()
+    'execv can only replace the whole server from the top-level process; workers always restart gracefully'
+    in_worker = os.getenv('SERVER_PID', str(os.getpid())) != str(os.getpid())
+    if can_restart_gracefully() and (mode == 'graceful' or in_worker):
+        logger.info('Graceful server restart requested. Handing the listening socket to a new server...')
+        'The top-level server process watches for this setting (see watch_for_restart)'
+        process_store.set_setting('restart_server_id', os.getenv('SERVER_ID'))
+        return {'message': 'Server is restarting gracefully; background processes will keep running'}
+    logger.info('Server restart requested. Restarting server in place...')
 
     async def delayed_restart():
         await asyncio.sleep(1)
-        os.execv(sys.executable, [sys.executable] + sys.argv)
+        os.execv(sys.executable, [sys.executable, os.path.abspath(__file__)] + sys.argv[1:])
     asyncio.create_task(delayed_restart())
     return {'message': 'Server will restart shortly'}
 
@@ -95,7 +176,41 @@ if __name__ == '__main__':
     if not PORT:
         PORT = DEFAULT_PORT
         dotenv.set_key(ENV_PATH, 'PORT', DEFAULT_PORT)
+    'Workers share the process registry and working directory through process_store'
+    WORKERS = int(os.getenv('WORKERS', DEFAULT_WORKERS))
+    DRAIN_TIMEOUT = int(os.getenv('RESTART_DRAIN_TIMEOUT', DEFAULT_DRAIN_TIMEOUT))
+    'Reuse the listening socket handed over by a gracefully restarting server, or bind a new one'
+    if os.getenv('LISTEN_FD') and os.name != 'nt':
+        sock = socket.socket(fileno=int(os.getenv('LISTEN_FD')))
+    else:
+        process_store.set_setting('cwd', os.getcwd())
+        sock = socket.create_server((HOST, int(PORT)), backlog=2048)
+    sock.set_inheritable(True)
+    os.environ['LISTEN_FD'] = str(sock.fileno())
+    os.environ['SERVER_PID'] = str(os.getpid())
+    'Restart requests name the server by a unique id rather than its PID, which a later server could reuse'
+    os.environ['SERVER_ID'] = uuid.uuid4().hex
+
+    def watch_for_restart():
+        """
+        Waits until a worker requests a graceful restart of this server, starts the replacement
+        server on the shared socket, then lets uvicorn drain in-flight requests and exit.
+        """
+        while process_store.get_setting('restart_server_id') != os.environ['SERVER_ID']:
+            time.sleep(RESTART_POLL_INTERVAL)
+        'Consume the request so it cannot fire again; workers read draining_server_id while shutting down'
+        process_store.set_setting('draining_server_id', os.environ['SERVER_ID'])
+        process_store.set_setting('restart_server_id', None)
+        logger.info('Starting replacement server on the inherited listening socket...')
+        subprocess.Popen([sys.executable, os.path.abspath(__file__)] + sys.argv[1:], pass_fds=(sock.fileno(),))
+        os.kill(os.getpid(), signal.SIGTERM)
+    if os.name != 'nt':
+        threading.Thread(target=watch_for_restart, daemon=True).start()
     'Runs the Uvicorn server directly inside the script.'
-    print('🚀 Starting Uvicorn server...')
+    print(f'🚀 Starting Uvicorn server with {WORKERS} worker(s)...')
     print(f'🔑 Your API Key: {API_KEY}')
-    uvicorn.run('main:app', host=HOST, port=int(PORT), log_level='debug')
\ No newline at end of file
+    if os.name == 'nt':
+        sock.close()
+        uvicorn.run('main:app', host=HOST, port=int(PORT), workers=WORKERS, log_level='debug')
+    else:
+        uvicorn.run('main:app', fd=sock.fileno(), workers=WORKERS, timeout_graceful_shutdown=DRAIN_TIMEOUT, log_level='debug')
\ No newline at end of file
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import shutil
+import signal
+
+try:
+    import resource
+except ImportError:  # resource limits are POSIX-only
+    resource = None
+
+# Default limits; read at call time because routers are imported before main loads .env
+DEFAULT_COMMAND_TIMEOUT = '300'
+DEFAULT_COMMAND_MAX_OUTPUT_BYTES = str(10 * 1024 * 1024)
+DEFAULT_KILL_GRACE_PERIOD = '5'
+# Windows has no SIGKILL; os.kill with SIGTERM already calls TerminateProcess there
+KILL_SIGNAL = getattr(signal, 'SIGKILL', signal.SIGTERM)
+LIMIT_FIELDS = ('timeout', 'cpu_seconds', 'memory_mb', 'max_open_files', 'max_output_bytes', 'nice', 'ionice')
+
+def kill_grace_period() -> float:
+    """Seconds between SIGTERM and SIGKILL when a command is terminated."""
+    return float(os.getenv('COMMAND_KILL_GRACE', DEFAULT_KILL_GRACE_PERIOD))
+
+def resolve_limits(request, background: bool = False) -> dict:
+    """
+    Merges the limits set on a command request with the configured defaults.
+    A timeout or max_output_bytes of 0 disables that limit; unset limits are omitted.
+    /run-command defaults to COMMAND_TIMEOUT and COMMAND_MAX_OUTPUT_BYTES, /start-process to PROCESS_TIMEOUT.
+    """
+    limits = {field: getattr(request, field, None) for field in LIMIT_FIELDS}
+    if limits['timeout'] is None:
+        limits['timeout'] = os.getenv('PROCESS_TIMEOUT') if background else os.getenv('COMMAND_TIMEOUT', DEFAULT_COMMAND_TIMEOUT)
+    if limits['max_output_bytes'] is None and not background:
+        limits['max_output_bytes'] = os.getenv('COMMAND_MAX_OUTPUT_BYTES', DEFAULT_COMMAND_MAX_OUTPUT_BYTES)
+    if limits['timeout'] is not None:
+        limits['timeout'] = float(limits['timeout'])
+    if limits['max_output_bytes'] is not None:
+        limits['max_output_bytes'] = int(limits['max_output_bytes'])
+    return {field: value for (field, value) in limits.items() if value is not None and not (value == 0 and field in ('timeout', 'max_output_bytes'))}
+
+def build_preexec_fn(limits: dict, file_size_limit: int | None = None):
+    """
+    Returns a function that applies rlimits and the nice level in the child before exec,
+    so the shell and everything it spawns inherit them. Returns None when nothing applies.
+    file_size_limit sets RLIMIT_FSIZE, used to cap background job logs between output checks.
+    Only plain system calls run here: the child of a threaded server must not take locks between fork and exec.
+    """
+    if os.name == 'nt' or (file_size_limit is None and not any(field in limits for field in ('cpu_seconds', 'memory_mb', 'max_open_files', 'nice'))):
+        return None
+
+    def apply_limits():
+        if 'cpu_seconds' in limits:
+            # SIGXCPU at the soft limit, SIGKILL one second later if it is ignored
+            resource.setrlimit(resource.RLIMIT_CPU, (limits['cpu_seconds'], limits['cpu_seconds'] + 1))
+        if 'memory_mb' in limits:
+            memory_bytes = limits['memory_mb'] * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+        if 'max_open_files' in limits:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limits['max_open_files'], limits['max_open_files']))
+        if file_size_limit is not None:
+            resource.setrlimit(resource.RLIMIT_FSIZE, (file_size_limit, file_size_limit))
+        if 'nice' in limits:
+            os.nice(limits['nice'])
+    return apply_limits
+
+def apply_ionice(command: str, limits: dict) -> str:
+    """
+    Prefixes a shell command so the shell first moves itself into the best-effort I/O class at the
+    requested level; everything the command spawns inherits it. Needs util-linux ionice (Linux only).
+    """
+    if 'ionice' not in limits or os.name == 'nt' or shutil.which('ionice') is None:
+        return command
+    return f"ionice -c 2 -n {int(limits['ionice'])} -p $$ >/dev/null 2>&1\n{command}"
+
+def signal_process_group(pid: int, sig) -> bool:
+    """Signals the whole process group led by pid; returns False if it is already gone."""
+    try:
+        if os.name == 'nt':
+            os.kill(pid, sig)
+        else:
+            os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        return False
+    return True
+
+async def terminate_process_group(process, grace: float | None = None):
+    """
+    Sends SIGTERM to the process group of an asyncio subprocess started with start_new_session,
+    then SIGKILL to whatever is left of the group after the grace period. The group is signalled
+    even if the shell itself already exited, so orphaned grandchildren are cleaned up too.
+    """
+    if os.name == 'nt':
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+        return
+    if not signal_process_group(process.pid, signal.SIGTERM):
+        await process.wait()
+        return
+    try:
+        await asyncio.wait_for(process.wait(), kill_grace_period() if grace is None else grace)
+    except asyncio.TimeoutError:
+        pass
+    signal_process_group(process.pid, KILL_SIGNAL)
+    await process.wait()
+
+def termination_reason(returncode, reason: str | None = None) -> str:
+    """
+    Describes why a command ended: the enforcing limit when the server killed it,
+    otherwise 'exited', 'cpu_limit' (SIGXCPU), 'output_limit' (SIGXFSZ) or 'signal'.
+    """
+    if reason:
+        return reason
+    if returncode is None:
+        return 'unknown'
+    for (name, limit_reason) in (('SIGXCPU', 'cpu_limit'), ('SIGXFSZ', 'output_limit')):
+        signum = getattr(signal, name, None)
+        if signum and returncode in (-signum, 128 + signum):
+            return limit_reason
+    if returncode < 0:
+        return 'signal'
+    return 'exited'
@@ -0,0 +1,205 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from logger import BASE_DIR
+
+STATE_DIR = BASE_DIR / 'tmp'
+DEFAULT_DB_PATH = str(STATE_DIR / 'state.db')
+_local = threading.local()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processes (
+    process_id TEXT PRIMARY KEY,
+    command TEXT NOT NULL,
+    pid INTEGER,
+    pid_create_time REAL,
+    log_file TEXT NOT NULL,
+    owner_pid INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running',
+    returncode INTEGER,
+    stop_requested INTEGER NOT NULL DEFAULT 0,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    limits TEXT,
+    termination_reason TEXT,
+    cpu_time REAL,
+    rss_peak INTEGER,
+    io_read_bytes INTEGER,
+    io_write_bytes INTEGER
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS watch_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    time REAL NOT NULL,
+    type TEXT NOT NULL,
+    path TEXT NOT NULL,
+    entry TEXT
+);
+CREATE TABLE IF NOT EXISTS index_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    time REAL NOT NULL,
+    path TEXT NOT NULL
+);
+"""
+# Columns added after the first release; databases created by older versions are migrated on connect
+ADDED_COLUMNS = {
+    'processes': [('limits', 'TEXT'), ('termination_reason', 'TEXT'), ('cpu_time', 'REAL'), ('rss_peak', 'INTEGER'),
+                  ('io_read_bytes', 'INTEGER'), ('io_write_bytes', 'INTEGER'), ('pid_create_time', 'REAL')],
+}
+
+def migrate(conn: sqlite3.Connection):
+    for (table, columns) in ADDED_COLUMNS.items():
+        existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+        for (name, column_type) in columns:
+            if name not in existing:
+                try:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+                except sqlite3.OperationalError:
+                    pass  # another worker added it first
+
+def db_path() -> str:
+    return os.getenv('STATE_DB_PATH', DEFAULT_DB_PATH)
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Returns this thread's connection to the shared state database.
+    The database runs in WAL mode so every worker can read while one writes.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'pid', None) != os.getpid():
+        path = db_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        migrate(conn)
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+def register_process(process_id: str, command: str, pid: int, log_file: str, limits: dict | None = None, pid_create_time: float | None = None):
+    """
+    Records a newly started background process as owned by this worker.
+    pid_create_time tells the process apart from a later one that reuses its PID.
+    """
+    get_connection().execute(
+        'INSERT INTO processes (process_id, command, pid, pid_create_time, log_file, owner_pid, started_at, limits) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (process_id, command, pid, pid_create_time, log_file, os.getpid(), time.time(), json.dumps(limits or {})))
+
+def _record(row) -> dict:
+    record = dict(row)
+    record['limits'] = json.loads(record['limits']) if record.get('limits') else {}
+    return record
+
+def get_process(process_id: str):
+    row = get_connection().execute('SELECT * FROM processes WHERE process_id = ?', (process_id,)).fetchone()
+    return _record(row) if row else None
+
+def list_processes(status: str | None = None):
+    if status:
+        rows = get_connection().execute('SELECT * FROM processes WHERE status = ? ORDER BY started_at', (status,)).fetchall()
+    else:
+        rows = get_connection().execute('SELECT * FROM processes ORDER BY started_at').fetchall()
+    return [_record(row) for row in rows]
+
+def adopt_process(process_id: str, previous_owner: int) -> bool:
+    """
+    Transfers a running process to this worker if it still belongs to previous_owner.
+    Returns False when another worker adopted it first.
+    """
+    cursor = get_connection().execute(
+        "UPDATE processes SET owner_pid = ? WHERE process_id = ? AND owner_pid = ? AND status = 'running'",
+        (os.getpid(), process_id, previous_owner))
+    return cursor.rowcount == 1
+
+def mark_finished(process_id: str, returncode, status: str = 'completed', termination_reason: str | None = None):
+    get_connection().execute(
+        "UPDATE processes SET status = ?, returncode = ?, termination_reason = ?, finished_at = ? WHERE process_id = ? AND status = 'running'",
+        (status, returncode, termination_reason, time.time(), process_id))
+
+def update_usage(process_id: str, usage: dict):
+    """Stores the latest resource usage sample of a background process."""
+    get_connection().execute(
+        'UPDATE processes SET cpu_time = ?, rss_peak = ?, io_read_bytes = ?, io_write_bytes = ? WHERE process_id = ?',
+        (usage['cpu_time'], usage['rss_peak'], usage['io_read_bytes'], usage['io_write_bytes'], process_id))
+
+def request_stop(process_id: str):
+    """Flags a process so that its owning worker terminates it."""
+    get_connection().execute('UPDATE processes SET stop_requested = 1 WHERE process_id = ?', (process_id,))
+
+def stop_requested(process_id: str) -> bool:
+    row = get_connection().execute('SELECT stop_requested FROM processes WHERE process_id = ?', (process_id,)).fetchone()
+    return bool(row and row['stop_requested'])
+
+def delete_process(process_id: str):
+    get_connection().execute('DELETE FROM processes WHERE process_id = ?', (process_id,))
+
+def get_setting(key: str, default=None):
+    row = get_connection().execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+    return row['value'] if row else default
+
+def set_setting(key: str, value):
+    get_connection().execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
+
+def append_watch_events(events: list, keep: int) -> int:
+    """Stores change events published by the watching worker, keeping only the newest keep; returns the last seq."""
+    conn = get_connection()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany('INSERT INTO watch_events (time, type, path, entry) VALUES (?, ?, ?, ?)',
+                         [(now, event['type'], event['path'], json.dumps(event['entry'])) for event in events])
+        seq = conn.execute('SELECT MAX(seq) AS seq FROM watch_events').fetchone()['seq']
+        conn.execute('DELETE FROM watch_events WHERE seq <= ?', (seq - keep,))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return seq
+
+def last_watch_event_seq() -> int:
+    row = get_connection().execute("SELECT seq FROM sqlite_sequence WHERE name = 'watch_events'").fetchone()
+    return row['seq'] if row else 0
+
+def watch_events_since(seq: int) -> tuple:
+    """Returns (events after seq, oldest stored seq or None)."""
+    conn = get_connection()
+    rows = conn.execute('SELECT * FROM watch_events WHERE seq > ? ORDER BY seq', (seq,)).fetchall()
+    oldest = conn.execute('SELECT MIN(seq) AS seq FROM watch_events').fetchone()['seq']
+    events = [{'seq': row['seq'], 'time': row['time'], 'type': row['type'], 'path': row['path'],
+               'entry': json.loads(row['entry']) if row['entry'] else None} for row in rows]
+    return (events, oldest)
+
+def add_index_changes(paths: list):
+    """Publishes files whose search-index entries are stale, so every worker re-indexes them."""
+    conn = get_connection()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany('INSERT INTO index_changes (time, path) VALUES (?, ?)', [(now, path) for path in paths])
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+def last_index_change_seq() -> int:
+    row = get_connection().execute("SELECT seq FROM sqlite_sequence WHERE name = 'index_changes'").fetchone()
+    return row['seq'] if row else 0
+
+def index_changes_since(seq: int) -> tuple:
+    """Returns (distinct paths changed after seq, last seq, oldest stored seq or None)."""
+    conn = get_connection()
+    rows = conn.execute('SELECT seq, path FROM index_changes WHERE seq > ? ORDER BY seq', (seq,)).fetchall()
+    oldest = conn.execute('SELECT MIN(seq) AS seq FROM index_changes').fetchone()['seq']
+    paths = list(dict.fromkeys(row['path'] for row in rows))
+    return (paths, rows[-1]['seq'] if rows else seq, oldest)
+
+def prune_index_changes(before: float):
+    get_connection().execute('DELETE FROM index_changes WHERE time < ?', (before,))
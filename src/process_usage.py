@@ -0,0 +1,67 @@
+import time
+import psutil
+
+class UsageSampler:
+    """
+    Accumulates resource usage of a background job and its whole process tree from periodic psutil samples.
+    CPU time includes descendants that already exited and were reaped inside the tree (via children_user/system),
+    IO bytes of exited descendants are kept from their last sample, and the RSS peak is the largest sampled tree total.
+    """
+
+    def __init__(self, pid: int, previous: dict | None = None):
+        self.pid = pid
+        previous = previous or {}
+        self.cpu_time = previous.get('cpu_time') or 0.0
+        self.rss_peak = previous.get('rss_peak') or 0
+        self.io_read_bytes = previous.get('io_read_bytes') or 0
+        self.io_write_bytes = previous.get('io_write_bytes') or 0
+        self._process = None
+        self._io_live = {}
+        self._io_exited = (0, 0)
+
+    def _tree(self) -> list:
+        if self._process is None:
+            self._process = psutil.Process(self.pid)
+        return [self._process] + self._process.children(recursive=True)
+
+    def sample(self) -> dict:
+        """Takes one sample of the process tree; usage only ever grows, so a vanished tree keeps the last totals."""
+        try:
+            processes = self._tree()
+        except psutil.Error:
+            return self.usage()
+        (cpu_time, rss, io_live) = (0.0, 0, {})
+        for process in processes:
+            try:
+                with process.oneshot():
+                    times = process.cpu_times()
+                    cpu_time += times.user + times.system + getattr(times, 'children_user', 0) + getattr(times, 'children_system', 0)
+                    rss += process.memory_info().rss
+                    if hasattr(process, 'io_counters'):
+                        io = process.io_counters()
+                        io_live[(process.pid, process.create_time())] = (io.read_bytes, io.write_bytes)
+            except psutil.Error:
+                continue
+        (exited_read, exited_write) = self._io_exited
+        for (key, (read_bytes, write_bytes)) in self._io_live.items():
+            if key not in io_live:
+                exited_read += read_bytes
+                exited_write += write_bytes
+        self._io_exited = (exited_read, exited_write)
+        self._io_live = io_live
+        self.cpu_time = max(self.cpu_time, cpu_time)
+        self.rss_peak = max(self.rss_peak, rss)
+        self.io_read_bytes = max(self.io_read_bytes, exited_read + sum(r for (r, _) in io_live.values()))
+        self.io_write_bytes = max(self.io_write_bytes, exited_write + sum(w for (_, w) in io_live.values()))
+        return self.usage()
+
+    def usage(self) -> dict:
+        return {'cpu_time': round(self.cpu_time, 3), 'rss_peak': self.rss_peak,
+                'io_read_bytes': self.io_read_bytes, 'io_write_bytes': self.io_write_bytes}
+
+def usage_summary(record: dict) -> dict:
+    """Formats the usage stored with a process record, adding wall time (still counting while it runs)."""
+    finished_at = record.get('finished_at') or time.time()
+    return {'cpu_time': record.get('cpu_time') or 0.0, 'rss_peak': record.get('rss_peak') or 0,
+            'io_read_bytes': record.get('io_read_bytes') or 0, 'io_write_bytes': record.get('io_write_bytes') or 0,
+            'wall_time': round(finished_at - record['started_at'], 3)}
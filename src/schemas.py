@@ -1,5 +1,5 @@
 from pydantic import BaseModel, RootModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 class CommandRequest(BaseModel):
     command: str
@@ -14,6 +14,12 @@ class AppendFileRequest(BaseModel):
 
 class ReadFileRequest(BaseModel):
     filepath: str
+    if_none_match: Optional[str] = None  # ETag from a previous read, for clients that cannot send If-None-Match
+
+class ListDirectoryRequest(BaseModel):
+    path: str = "."
+    recursive: bool = False
+    max_entries: int = 5000
 
 class ReadLinesRequest(BaseModel):
     filepath: str
@@ -33,3 +39,16 @@ class ReplaceTextRequest(BaseModel):
 class ReadFuncRequest(BaseModel):
     filepath: str
     function_name: str
+
+class SearchRequest(BaseModel):
+    pattern: str
+    path: str = "."
+    regex: bool = False
+    case_sensitive: bool = True
+    include: Optional[List[str]] = None  # Glob patterns; only matching files are scanned
+    exclude: Optional[List[str]] = None  # .gitignore-style patterns applied on top of .gitignore files
+    use_gitignore: bool = True
+    use_index: bool = True  # False scans every file instead of only the search index's candidates
+    max_results: int = 1000
+    max_matches_per_file: int = 100
+    max_filesize: int = 50 * 1024 * 1024
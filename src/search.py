@@ -0,0 +1,335 @@
+import asyncio
+import fnmatch
+import mmap
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logger import system_logger
+from responses import dumps_json
+
+logger = system_logger
+
+SEARCH_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+BINARY_SNIFF_BYTES = 8192
+SNIPPET_MAX_CHARS = 300
+ALWAYS_SKIPPED_DIRS = {'.git', '.hg', '.svn'}
+_DONE = object()
+# One pool shared by every search, so concurrent searches queue for SEARCH_WORKERS threads instead of each starting their own
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix='search')
+        return _executor
+
+def _glob_to_regex(glob: str) -> str:
+    """Translates a gitignore-style glob ('*', '?', '**', [...]) into a regex fragment."""
+    out = []
+    i = 0
+    while i < len(glob):
+        c = glob[i]
+        if glob.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+            continue
+        if glob.startswith('**', i):
+            out.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = glob.find(']', i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = glob[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+class IgnoreRule:
+    """A single .gitignore-style pattern, scoped to the directory that declared it."""
+
+    def __init__(self, base_dir: str, pattern: str):
+        self.base_dir = base_dir
+        self._prefix = os.path.join(base_dir, '')
+        self.negated = pattern.startswith('!')
+        if self.negated:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # A slash at the start or in the middle anchors the pattern to base_dir; a trailing one does not
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        prefix = '' if anchored else '(?:.*/)?'
+        self.regex = re.compile(f'^{prefix}{_glob_to_regex(pattern)}(?:/.*)?$')
+
+    def matches(self, path: str, is_dir: bool) -> bool:
+        if not path.startswith(self._prefix):
+            return False
+        rel = path[len(self._prefix):].replace(os.sep, '/')
+        if self.dir_only and not is_dir:
+            # A directory-only rule still matches files underneath the directory.
+            parent = rel.rpartition('/')[0]
+            return bool(parent) and bool(self.regex.match(parent))
+        return bool(self.regex.match(rel))
+
+def parse_ignore_patterns(base_dir: str, lines) -> list:
+    rules = []
+    for line in lines:
+        line = line.rstrip('\n').rstrip()
+        if not line or line.startswith('#'):
+            continue
+        rules.append(IgnoreRule(base_dir, line))
+    return rules
+
+def load_gitignore(directory: str) -> list:
+    """Reads the .gitignore in a directory, if any, into a list of IgnoreRules."""
+    path = os.path.join(directory, '.gitignore')
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return parse_ignore_patterns(directory, f)
+    except OSError:
+        return []
+
+def find_repository_root(path: str):
+    """Returns the nearest directory at or above path that contains .git, or None outside a repository."""
+    directory = os.path.abspath(path)
+    while True:
+        if os.path.exists(os.path.join(directory, '.git')):
+            return directory
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+def load_ancestor_gitignores(path: str) -> list:
+    """
+    Reads the .gitignore files from the repository root down to the parent of path, outermost first,
+    so searching a subdirectory honours the same rules as searching the whole repository.
+    path's own .gitignore is left to the walk.
+    """
+    path = os.path.abspath(path)
+    repository = find_repository_root(path)
+    if repository is None or path == repository:
+        return []
+    directories = []
+    directory = os.path.dirname(path)
+    while True:
+        directories.append(directory)
+        if directory == repository:
+            break
+        directory = os.path.dirname(directory)
+    rules = []
+    for directory in reversed(directories):
+        rules += load_gitignore(directory)
+    return rules
+
+def is_ignored(rules: list, path: str, is_dir: bool) -> bool:
+    """Applies rules in order; like git, the last matching rule wins and '!' re-includes."""
+    ignored = False
+    for rule in rules:
+        if rule.negated == ignored and rule.matches(path, is_dir):
+            ignored = not rule.negated
+    return ignored
+
+def compile_pattern(pattern: str, regex: bool = False, case_sensitive: bool = True):
+    """Compiles a search pattern into a bytes regex usable directly against an mmap."""
+    source = pattern.encode('utf-8') if regex else re.escape(pattern.encode('utf-8'))
+    flags = re.MULTILINE if case_sensitive else re.MULTILINE | re.IGNORECASE
+    return re.compile(source, flags)
+
+def scan_file(path: str, compiled, max_matches: int, max_filesize: int, cancelled: threading.Event = None):
+    """
+    Scans a file through mmap and returns (line_number, column, snippet) for each matching line.
+    Returns None for binary, empty, oversized or unreadable files.
+    """
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0 or size > max_filesize:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm.find(b'\x00', 0, min(size, BINARY_SNIFF_BYTES)) != -1:
+                    return None
+                matches = []
+                line_number = 1
+                counted_to = 0
+                pos = 0
+                while pos <= size and len(matches) < max_matches:
+                    match = compiled.search(mm, pos)
+                    if match is None:
+                        break
+                    start = match.start()
+                    line_start = mm.rfind(b'\n', 0, start) + 1
+                    line_end = mm.find(b'\n', match.end() if match.end() > start else start)
+                    if line_end == -1:
+                        line_end = size
+                    line_number += mm[counted_to:line_start].count(b'\n')
+                    counted_to = line_start
+                    text = mm[line_start:line_end].decode('utf-8', errors='replace').rstrip('\r')
+                    column = len(mm[line_start:start].decode('utf-8', errors='replace')) + 1
+                    matches.append((line_number, column, text[:SNIPPET_MAX_CHARS]))
+                    pos = line_end + 1
+                    if cancelled is not None and cancelled.is_set():
+                        break
+                return matches
+    except (OSError, ValueError) as e:
+        logger.debug(f'Search skipped unreadable file {path}: {e}')
+        return None
+
+class SearchJob:
+    """
+    Walks a directory tree and scans files concurrently on the shared search thread pool.
+    Matches are handed to the event loop per file as they are found, so results can be
+    streamed while the search is still running and cancelled as soon as nobody is listening;
+    tasks of a cancelled job that are still queued return without doing any work.
+    """
+
+    def __init__(self, root: str, compiled, include=None, exclude=None, max_results: int = 1000,
+                 max_matches_per_file: int = 100, max_filesize: int = 50 * 1024 * 1024, use_gitignore: bool = True, candidates=None, index_age=None):
+        self.root = root
+        self.candidates = candidates
+        self.index_age = index_age
+        self.compiled = compiled
+        self.include = include or []
+        self.root_rules = (load_ancestor_gitignores(root) if use_gitignore else []) + parse_ignore_patterns(root, exclude or [])
+        self.max_results = max_results
+        self.max_matches_per_file = max_matches_per_file
+        self.max_filesize = max_filesize
+        self.use_gitignore = use_gitignore
+        self.cancelled = threading.Event()
+        self.files_scanned = 0
+        self.matches_found = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._queue = None
+        self._loop = None
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            self._pending += 1
+        try:
+            get_executor().submit(self._run, fn, *args)
+        except RuntimeError:
+            # The pool is shutting down with the interpreter; nothing left to do.
+            self._finish_task()
+
+    def _finish_task(self):
+        with self._lock:
+            self._pending -= 1
+            done = self._pending == 0
+        if done:
+            self._emit(_DONE)
+
+    def _run(self, fn, *args):
+        try:
+            if not self.cancelled.is_set():
+                fn(*args)
+        except Exception as e:
+            logger.error(f'Search task failed: {e}')
+        finally:
+            self._finish_task()
+
+    def _emit(self, item):
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        except RuntimeError:
+            pass  # event loop already closed
+
+    def _included(self, path: str) -> bool:
+        if not self.include:
+            return True
+        rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+        name = os.path.basename(path)
+        return any(fnmatch.fnmatch(rel, glob) or fnmatch.fnmatch(name, glob) for glob in self.include)
+
+    def _walk_dir(self, directory: str, rules: list):
+        if self.use_gitignore:
+            rules = rules + load_gitignore(directory)
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if self.cancelled.is_set():
+                    return
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in ALWAYS_SKIPPED_DIRS and not is_ignored(rules, entry.path, True):
+                            self._submit(self._walk_dir, entry.path, rules)
+                    elif entry.is_file(follow_symlinks=False):
+                        if self._included(entry.path) and not is_ignored(rules, entry.path, False):
+                            self._submit(self._scan_file, entry.path)
+                except OSError:
+                    continue
+
+    def _scan_candidates(self):
+        for path in self.candidates:
+            if self.cancelled.is_set():
+                return
+            if self._included(path) and not is_ignored(self.root_rules, path, False):
+                self._submit(self._scan_file, path)
+
+    def _scan_file(self, path: str):
+        matches = scan_file(path, self.compiled, self.max_matches_per_file, self.max_filesize, self.cancelled)
+        with self._lock:
+            self.files_scanned += 1
+        if matches:
+            self._emit((path, matches))
+
+    def cancel(self):
+        self.cancelled.set()
+
+    async def results(self):
+        """Yields one dict per matching line until the tree is exhausted or max_results is reached."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        if self.candidates is not None:
+            # The search index already narrowed the tree down to files that can match.
+            self._submit(self._scan_candidates)
+        elif os.path.isdir(self.root):
+            self._submit(self._walk_dir, self.root, self.root_rules)
+        else:
+            self._submit(self._scan_file, self.root)
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is _DONE:
+                    return
+                (path, matches) = item
+                for (line_number, column, text) in matches:
+                    if self.matches_found >= self.max_results:
+                        return
+                    self.matches_found += 1
+                    yield {'path': path, 'line': line_number, 'column': column, 'text': text}
+        finally:
+            self.cancel()
+
+    @property
+    def truncated(self) -> bool:
+        return self.matches_found >= self.max_results
+
+async def stream_search(job: SearchJob, pattern: str):
+    """
+    Streams a SearchJob as newline-delimited JSON: one object per match, then a summary line.
+    Closing the stream (e.g. on client disconnect) cancels the remaining work.
+    """
+    start = time.perf_counter()
+    async for result in job.results():
+        yield dumps_json(result) + b'\n'
+    elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+    summary = {'summary': {'matches': job.matches_found, 'files_scanned': job.files_scanned, 'truncated': job.truncated, 'elapsed_ms': elapsed_ms,
+                           'index_used': job.candidates is not None, 'index_age_seconds': job.index_age}}
+    logger.info(f'Search for {pattern!r} in {job.root}: {job.matches_found} matches in {job.files_scanned} files ({elapsed_ms} ms)')
+    yield dumps_json(summary) + b'\n'
@@ -0,0 +1,477 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+from array import array
+from contextlib import contextmanager
+import process_store
+from logger import system_logger, BASE_DIR
+from search import ALWAYS_SKIPPED_DIRS, BINARY_SNIFF_BYTES, is_ignored, load_ancestor_gitignores, load_gitignore
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds are not serialized across workers
+    fcntl = None
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+logger = system_logger
+
+INDEX_DIR = BASE_DIR / 'tmp' / 'search_index'
+MAGIC = b'TGI1'
+DEFAULT_MAX_FILESIZE = 4 * 1024 * 1024
+DEFAULT_REFRESH_SECONDS = 30
+COMPACT_THRESHOLD = 2000
+# How often every worker applies published changes, and the least time between refreshes asked for by request_refresh()
+PULL_SECONDS = 1
+MIN_REFRESH_INTERVAL = 2
+# Published changes older than this are pruned; a worker that missed them walks the tree itself
+CHANGE_RETENTION_SECONDS = 600
+
+# File states recorded in files.json
+INDEXED, UNINDEXED, BINARY = 0, 1, 2
+
+def file_trigrams(data: bytes) -> set:
+    """Returns the set of case-folded trigrams in data, packed into 24-bit integers."""
+    data = data.lower()
+    return {int.from_bytes(data[i:i + 3], 'big') for i in range(len(data) - 2)}
+
+def read_for_index(path: str, max_filesize: int):
+    """Returns (state, trigrams, mtime_ns, size) for a file, or None if it cannot be read."""
+    try:
+        stat = os.stat(path)
+        if stat.st_size > max_filesize:
+            return (UNINDEXED, None, stat.st_mtime_ns, stat.st_size)
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if b'\x00' in data[:BINARY_SNIFF_BYTES]:
+        return (BINARY, None, stat.st_mtime_ns, stat.st_size)
+    return (INDEXED, file_trigrams(data), stat.st_mtime_ns, stat.st_size)
+
+def required_literals(pattern: str, regex: bool) -> list:
+    """
+    Extracts literal substrings that every match must contain. For regexes only top-level
+    literal runs are used, which is conservative: it may over-select files but never misses one.
+    """
+    if not regex:
+        return [pattern]
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return []
+    literals = []
+    run = []
+    for (op, av) in parsed:
+        if op is sre_constants.LITERAL:
+            run.append(chr(av))
+            continue
+        if run:
+            literals.append(''.join(run))
+            run = []
+    if run:
+        literals.append(''.join(run))
+    return literals
+
+def query_trigrams(literals: list) -> set:
+    trigrams = set()
+    for literal in literals:
+        trigrams |= file_trigrams(literal.encode('utf-8'))
+    return trigrams
+
+class TrigramIndex:
+    """
+    Trigram posting-list index over a directory tree.
+
+    The base index lives on disk as sorted uint32 arrays (trigram keys, offsets, file ids)
+    that are memory-mapped for lookups. Files changed since the base was built are kept in
+    an in-memory overlay and the base is rewritten once the overlay grows large. Every worker keeps
+    its own overlay, fed from changes published in the shared process store; refreshing and
+    rewriting happen once, on the background thread of the worker holding the refresh lock,
+    never on a query.
+    """
+
+    def __init__(self, root: str, max_filesize: int = DEFAULT_MAX_FILESIZE, refresh_seconds: float = DEFAULT_REFRESH_SECONDS):
+        self.root = os.path.abspath(root)
+        self.max_filesize = max_filesize
+        self.refresh_seconds = refresh_seconds
+        self.directory = INDEX_DIR / hashlib.sha1(self.root.encode('utf-8')).hexdigest()[:16]
+        self.ready = False
+        self._lock = threading.RLock()
+        self._files = []
+        self._path_ids = {}
+        self._mm = None
+        self._keys = None
+        self._offsets = None
+        self._postings = None
+        self._overlay = {}
+        self._pull_lock = threading.Lock()
+        self._generation = None
+        self._applied_seq = 0
+        self._refresh_lock_file = None
+        self.refreshed_at = 0.0
+
+    # ---- building and loading the on-disk base ----
+
+    def _walk(self):
+        """Yields indexable file paths under root, honoring .gitignore files."""
+        stack = [(self.root, load_ancestor_gitignores(self.root))]
+        while stack:
+            (directory, rules) = stack.pop()
+            rules = rules + load_gitignore(directory)
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if entry.name not in ALWAYS_SKIPPED_DIRS and not is_ignored(rules, entry.path, True):
+                                    stack.append((entry.path, rules))
+                            elif entry.is_file(follow_symlinks=False) and not is_ignored(rules, entry.path, False):
+                                yield entry.path
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+    def build(self):
+        """Indexes every file under root from scratch and writes the base index to disk."""
+        start = time.perf_counter()
+        files = []
+        postings = {}
+        for path in self._walk():
+            result = read_for_index(path, self.max_filesize)
+            if result is None:
+                continue
+            (state, trigrams, mtime_ns, size) = result
+            file_id = len(files)
+            files.append([path, mtime_ns, size, state])
+            for trigram in trigrams or ():
+                posting = postings.get(trigram)
+                if posting is None:
+                    posting = postings[trigram] = array('I')
+                posting.append(file_id)
+        self._write(files, postings)
+        logger.info(f'Built search index for {self.root}: {len(files)} files, {len(postings)} trigrams in {time.perf_counter() - start:.1f}s')
+
+    def _write(self, files: list, postings: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        keys = array('I', sorted(postings))
+        offsets = array('I', [0])
+        for key in keys:
+            offsets.append(offsets[-1] + len(postings[key]))
+        tmp_postings = self.directory / f'postings.bin.{os.getpid()}.tmp'
+        with open(tmp_postings, 'wb') as f:
+            f.write(MAGIC + struct.pack('=I', len(keys)))
+            keys.tofile(f)
+            offsets.tofile(f)
+            for key in keys:
+                postings[key].tofile(f)
+        tmp_files = self.directory / f'files.json.{os.getpid()}.tmp'
+        with open(tmp_files, 'w', encoding='utf-8') as f:
+            json.dump({'root': self.root, 'max_filesize': self.max_filesize, 'files': files}, f)
+        os.replace(tmp_postings, self.directory / 'postings.bin')
+        os.replace(tmp_files, self.directory / 'files.json')
+
+    def load(self) -> bool:
+        """Memory-maps the base index from disk. Returns False if there is none to load."""
+        try:
+            with open(self.directory / 'files.json', 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            postings_file = open(self.directory / 'postings.bin', 'rb')
+        except (OSError, ValueError):
+            return False
+        with postings_file:
+            mm = mmap.mmap(postings_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:4] != MAGIC or manifest.get('max_filesize') != self.max_filesize:
+            mm.close()
+            return False
+        (count,) = struct.unpack('=I', mm[4:8])
+        view = memoryview(mm)[8:]
+        with self._lock:
+            self._release_mmap()
+            self._mm = mm
+            self._keys = view[:count * 4].cast('I')
+            self._offsets = view[count * 4:(2 * count + 1) * 4].cast('I')
+            self._postings = view[(2 * count + 1) * 4:].cast('I')
+            self._files = manifest['files']
+            self._path_ids = {entry[0]: file_id for (file_id, entry) in enumerate(self._files)}
+            self._overlay = {}
+            self.ready = True
+        return True
+
+    def _release_mmap(self):
+        for view in (self._keys, self._offsets, self._postings):
+            if view is not None:
+                view.release()
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                pass  # a query still holds a view; the mapping is freed with it
+        self._mm = self._keys = self._offsets = self._postings = None
+
+    @contextmanager
+    def _build_lock(self):
+        """Serializes writing and loading the on-disk base across workers, so none loads a half-replaced pair of files."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.directory / 'build.lock', 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def open(self):
+        """
+        Loads the index from disk, building it first if needed. Changes published after the
+        base was built are applied by the next pull.
+        """
+        (seq, started) = (process_store.last_index_change_seq(), time.time())
+        with self._build_lock():
+            if not self.load():
+                self.build()
+                self._publish_base(seq, started)
+                self.load()
+            generation = process_store.get_setting(self._setting('generation'))
+        with self._pull_lock:
+            self._generation = generation
+            self._applied_seq = int(generation.split(':')[1]) if generation else seq
+        self.pull()
+
+    def _setting(self, name: str) -> str:
+        return f'search_index:{self.root}:{name}'
+
+    def _publish_base(self, seq: int, started: float):
+        """Tells every worker a new base was written, containing the changes published up to seq."""
+        process_store.set_setting(self._setting('generation'), f'{uuid.uuid4().hex}:{seq}')
+        process_store.set_setting(self._setting('refreshed_at'), started)
+
+    # ---- incremental updates ----
+
+    def notify_changed(self, path: str):
+        """Publishes a file written through the API, so every worker re-indexes it before its next query."""
+        path = os.path.abspath(path)
+        if path.startswith(os.path.join(self.root, '')):
+            process_store.add_index_changes([path])
+
+    def acquire_refresh_lock(self) -> bool:
+        """
+        Makes this worker the one that walks the tree and compacts, if no other worker is. The
+        others only apply what it publishes. Without fcntl every worker refreshes on its own.
+        """
+        if fcntl is None or self._refresh_lock_file is not None:
+            return True
+        lock_file = open(self.directory / 'refresh.lock', 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._refresh_lock_file = lock_file
+        return True
+
+    def _scan_changes(self) -> list:
+        """Walks the tree and returns the files whose mtime or size differ from the index, including new and deleted ones."""
+        with self._lock:
+            (files, path_ids, overlay) = (self._files, self._path_ids, dict(self._overlay))
+        seen = set()
+        changed = []
+        for path in self._walk():
+            seen.add(path)
+            indexed = overlay.get(path, ...)
+            if indexed is ...:
+                file_id = path_ids.get(path)
+                known = files[file_id][1:3] if file_id is not None else None
+            else:
+                known = indexed[2:4] if indexed is not None else None
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if known is None or known[0] != stat.st_mtime_ns or known[1] != stat.st_size:
+                changed.append(path)
+        for path in set(path_ids) | set(overlay):
+            if path not in seen and overlay.get(path, ...) is not None:
+                changed.append(path)
+        return changed
+
+    def refresh(self):
+        """
+        Publishes the files whose mtime or size changed since they were indexed, including new and
+        deleted ones, so every worker re-indexes them on its next pull. Rebuilds the base instead
+        once the changes would grow the overlay past COMPACT_THRESHOLD.
+        """
+        if not self.ready:
+            return
+        started = time.time()
+        changed = self._scan_changes()
+        if len(self._overlay) + len(changed) > COMPACT_THRESHOLD:
+            self._compact()
+        else:
+            if changed:
+                process_store.add_index_changes(changed)
+            process_store.set_setting(self._setting('refreshed_at'), started)
+        process_store.prune_index_changes(started - CHANGE_RETENTION_SECONDS)
+        self.pull()
+
+    def _compact(self):
+        """
+        Rewrites the base index on disk. Workers load it on their next pull and re-apply the
+        changes published since the rebuild started, since the new base may predate them.
+        """
+        logger.info(f'Compacting search index for {self.root} ({len(self._overlay)} changed files)')
+        (seq, started) = (process_store.last_index_change_seq(), time.time())
+        with self._build_lock():
+            self.build()
+            self._publish_base(seq, started)
+
+    def pull(self):
+        """
+        Applies what any worker published since the last pull: a new base after a compaction and
+        files written through the API or found changed by a refresh. Workers that fell so far behind
+        that the changes they needed were pruned walk the tree themselves instead.
+        """
+        with self._pull_lock:
+            generation = process_store.get_setting(self._setting('generation'))
+            if generation is not None and generation != self._generation:
+                with self._build_lock():
+                    if not self.load():
+                        return
+                self._generation = generation
+                self._applied_seq = int(generation.split(':')[1])
+            (paths, seq, oldest) = process_store.index_changes_since(self._applied_seq)
+            if oldest is not None and oldest > self._applied_seq + 1:
+                paths = self._scan_changes()
+            updates = {path: read_for_index(path, self.max_filesize) for path in paths}
+            with self._lock:
+                self._overlay.update(updates)
+            self._applied_seq = seq
+            self.refreshed_at = float(process_store.get_setting(self._setting('refreshed_at'), 0) or 0)
+
+    def age(self) -> float:
+        """Seconds since the tree was last checked for changes made outside the API."""
+        return time.time() - self.refreshed_at
+
+    # ---- queries ----
+
+    def _posting(self, trigram: int) -> set:
+        i = bisect.bisect_left(self._keys, trigram)
+        if i == len(self._keys) or self._keys[i] != trigram:
+            return set()
+        return set(self._postings[self._offsets[i]:self._offsets[i + 1]])
+
+    def candidates(self, trigrams: set, under: str):
+        """
+        Returns the files under a directory that may contain all of the given trigrams,
+        plus every file too large to have been indexed.
+        """
+        self.pull()
+        prefix = os.path.join(os.path.abspath(under), '')
+        with self._lock:
+            file_ids = None
+            for trigram in sorted(trigrams, key=lambda t: self._posting_size(t)):
+                ids = self._posting(trigram)
+                file_ids = ids if file_ids is None else file_ids & ids
+                if not file_ids:
+                    break
+            result = set()
+            for file_id in file_ids or ():
+                path = self._files[file_id][0]
+                if path not in self._overlay:
+                    result.add(path)
+            for (file_id, entry) in enumerate(self._files):
+                if entry[3] == UNINDEXED and entry[0] not in self._overlay:
+                    result.add(entry[0])
+            for (path, indexed) in self._overlay.items():
+                if indexed is None or indexed[0] == BINARY:
+                    continue
+                if indexed[0] == UNINDEXED or trigrams <= indexed[1]:
+                    result.add(path)
+        return sorted(path for path in result if path.startswith(prefix))
+
+    def _posting_size(self, trigram: int) -> int:
+        i = bisect.bisect_left(self._keys, trigram)
+        if i == len(self._keys) or self._keys[i] != trigram:
+            return 0
+        return self._offsets[i + 1] - self._offsets[i]
+
+_index = None
+
+def start(root: str, max_filesize: int = DEFAULT_MAX_FILESIZE, refresh_seconds: float = DEFAULT_REFRESH_SECONDS):
+    """
+    Opens (building if necessary) the index for root in a background thread, which then applies
+    published changes every PULL_SECONDS. In the worker holding the refresh lock it also walks the
+    tree every refresh_seconds, or sooner when asked by request_refresh(), so queries never pay
+    for a tree walk or a rebuild.
+    """
+    global _index
+    _index = TrigramIndex(root, max_filesize, refresh_seconds)
+    index = _index
+
+    def maintain_index():
+        try:
+            index.open()
+        except Exception as e:
+            logger.error(f'Failed to open search index for {root}: {e}')
+            return
+        last_refresh = 0
+        while True:
+            time.sleep(PULL_SECONDS)
+            try:
+                if index.acquire_refresh_lock():
+                    now = time.time()
+                    requested = float(process_store.get_setting(index._setting('refresh_requested'), 0) or 0)
+                    if now - last_refresh >= index.refresh_seconds or (requested > last_refresh and now - last_refresh >= MIN_REFRESH_INTERVAL):
+                        last_refresh = now
+                        index.refresh()
+                        continue
+                index.pull()
+            except Exception as e:
+                logger.error(f'Failed to refresh search index for {root}: {e}')
+    threading.Thread(target=maintain_index, name='search-index', daemon=True).start()
+    return _index
+
+def notify_changed(path):
+    """Called after files are written through the API so no worker's index serves stale candidates."""
+    if _index is not None:
+        _index.notify_changed(str(path))
+
+def request_refresh():
+    """Asks the refreshing worker to walk the tree soon, e.g. after a command that may have changed files."""
+    if _index is not None:
+        process_store.set_setting(_index._setting('refresh_requested'), time.time())
+
+def index_age():
+    """Seconds since the index last checked for changes made outside the API, or None without an index."""
+    if _index is None or not _index.ready:
+        return None
+    return round(_index.age(), 1)
+
+async def find_candidates(root: str, pattern: str, regex: bool):
+    """
+    Returns the candidate files under root for a query, or None when the index cannot narrow
+    the search (no index, not ready, root outside the indexed tree, or no usable trigrams).
+    """
+    if _index is None or not _index.ready:
+        return None
+    root = os.path.abspath(root)
+    if root != _index.root and not root.startswith(os.path.join(_index.root, '')):
+        return None
+    trigrams = query_trigrams(required_literals(pattern, regex))
+    if not trigrams:
+        return None
+    return await asyncio.to_thread(_index.candidates, trigrams, root)
@@ -1,20 +1,46 @@
 import asyncio
 import os
 import uuid
+import time
+import signal
 import atexit
-from pydantic import BaseModel
+import psutil
+from typing import Optional
+from pydantic import BaseModel, Field
 from fastapi import APIRouter, HTTPException
-from logger import system_logger
+from logger import system_logger, BASE_DIR
+import process_store
+import search_index
+from timing import span
+from process_usage import UsageSampler, usage_summary
+from process_limits import apply_ionice, build_preexec_fn, resolve_limits, signal_process_group, terminate_process_group, termination_reason, kill_grace_period, KILL_SIGNAL
 
 logger = system_logger
 router = APIRouter()
+# Background processes owned by this worker; the shared registry lives in process_store
 running_processes = {}
+PROCESS_LOG_DIR = str(BASE_DIR / 'tmp')
+STOP_POLL_INTERVAL = 0.5
+STOP_TIMEOUT = 10
+ADOPT_INTERVAL = 2
+OUTPUT_READ_SIZE = 64 * 1024
+# Usage is sampled on every poll but only written to the shared store this often
+USAGE_WRITE_INTERVAL = 2
+# Create times of the same process read twice can differ by rounding
+CREATE_TIME_TOLERANCE = 0.01
 
 class CDRequest(BaseModel):
     directory: str
 
 class CommandRequest(BaseModel):
     command: str
+    timeout: Optional[float] = Field(None, ge=0)  # Seconds before the process group is killed; 0 disables
+    cpu_seconds: Optional[int] = Field(None, gt=0)  # RLIMIT_CPU
+    memory_mb: Optional[int] = Field(None, gt=0)  # RLIMIT_AS
+    max_open_files: Optional[int] = Field(None, gt=0)  # RLIMIT_NOFILE
+    max_output_bytes: Optional[int] = Field(None, ge=0)  # Combined stdout/stderr (or log file) size; 0 disables
+    nice: Optional[int] = Field(None, ge=0, le=19)  # Added to the CPU niceness
+    ionice: Optional[int] = Field(None, ge=0, le=7)  # Best-effort I/O priority, 0 (highest) - 7 (lowest); Linux only
 
 @router.post('/set-current-directory')
 async def change_current_directory(request: CDRequest):
@@ -22,6 +48,7 @@ async def change_current_directory(request: CDRequest):
     if not os.path.exists(request.directory):
         raise HTTPException(status_code=400, detail='Invalid directory path')
     os.chdir(request.directory)
+    process_store.set_setting('cwd', os.getcwd())
     logger.info(f'Current directory changed to {request.directory}')
     return {'message': f'Current directory changed to {request.directory}'}
 
@@ -30,118 +57,373 @@ async def return_current_directory():
     """Returns the current working directory."""
     return {'message': f'The current working directory is {os.getcwd()}'}
 
+async def read_limited(stream, buffer: bytearray, buffers: list, max_bytes, exceeded: asyncio.Event):
+    """Reads a subprocess pipe into buffer until EOF or until all buffers together reach max_bytes."""
+    while chunk := await stream.read(OUTPUT_READ_SIZE):
+        if max_bytes is not None:
+            room = max_bytes - sum(len(b) for b in buffers)
+            if len(chunk) > room:
+                buffer += chunk[:max(room, 0)]
+                exceeded.set()
+                return
+        buffer += chunk
+
 @router.post('/run-command')
 async def run_terminal_command(request: CommandRequest):
-    """Runs a terminal command and returns its output."""
+    """
+    Runs a terminal command and returns its output.
+    The command runs in its own process group and is killed (SIGTERM, then SIGKILL) when it
+    exceeds its timeout or output limit; the response reports the limits and termination reason.
+    Afterwards the search index is asked to look for files the command changed.
+    """
+    limits = resolve_limits(request)
     try:
-        process = await asyncio.create_subprocess_shell(request.command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-        (stdout, stderr) = await process.communicate()
-        output = stdout.decode().strip()
-        error = stderr.decode().strip()
-        logger.info(f'Executed command: {request.command} | Output: {output} | Error: {error}')
-        return {'input': request.command, 'output': output, 'error': error}
+        with span('spawn'):
+            process = await asyncio.create_subprocess_shell(apply_ionice(request.command, limits), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                            start_new_session=True, preexec_fn=build_preexec_fn(limits))
+        (stdout, stderr) = (bytearray(), bytearray())
+        exceeded = asyncio.Event()
+        max_bytes = limits.get('max_output_bytes')
+        readers = asyncio.gather(read_limited(process.stdout, stdout, [stdout, stderr], max_bytes, exceeded),
+                                 read_limited(process.stderr, stderr, [stdout, stderr], max_bytes, exceeded))
+        limit_hit = asyncio.ensure_future(exceeded.wait())
+        deadline = time.monotonic() + limits['timeout'] if 'timeout' in limits else None
+        reason = None
+        with span('wait'):
+            try:
+                (done, _) = await asyncio.wait({readers, limit_hit}, timeout=limits.get('timeout'), return_when=asyncio.FIRST_COMPLETED)
+                if readers in done:
+                    # Output is closed, but the command itself may still be running
+                    try:
+                        await asyncio.wait_for(process.wait(), None if deadline is None else max(deadline - time.monotonic(), 0))
+                    except asyncio.TimeoutError:
+                        reason = 'timeout'
+                else:
+                    reason = 'output_limit' if limit_hit in done else 'timeout'
+                if reason:
+                    logger.warning(f'Command hit its {reason.replace("_", " ")}; killing process group {process.pid}: {request.command}')
+                    await terminate_process_group(process)
+            finally:
+                limit_hit.cancel()
+                readers.cancel()
+                if process.returncode is None:
+                    await terminate_process_group(process, grace=0)
+        with span('decode'):
+            output = stdout.decode(errors='replace').strip()
+            error = stderr.decode(errors='replace').strip()
+        reason = termination_reason(process.returncode, reason)
+        search_index.request_refresh()
+        with span('log'):
+            logger.info(f'Executed command: {request.command} | Output: {output} | Error: {error} | Termination: {reason}')
+        return {'input': request.command, 'output': output, 'error': error, 'returncode': process.returncode,
+                'termination_reason': reason, 'limits': limits}
     except Exception as e:
         logger.error(f'Command execution failed: {request.command} | Error: {str(e)}')
         raise HTTPException(status_code=500, detail=f'Command execution error: {str(e)}')
 
-async def run_long_command_to_log(command: str, process_id: str):
+def process_create_time(pid: int) -> float | None:
+    """Returns the start time of a process, or None if it does not exist."""
+    try:
+        return psutil.Process(pid).create_time()
+    except psutil.Error:
+        return None
+
+def is_pid_alive(pid, create_time: float | None = None) -> bool:
+    """
+    Returns True if a process with the given PID exists on this host.
+    With create_time it must also be the process that was recorded, not a later one reusing the PID.
+    """
+    if not pid:
+        return False
+    if create_time is not None:
+        current = process_create_time(pid)
+        return current is not None and abs(current - create_time) < CREATE_TIME_TOLERANCE
+    # Not os.kill(pid, 0): on Windows signal 0 is CTRL_C_EVENT
+    return psutil.pid_exists(pid)
+
+def started_before_boot(record: dict) -> bool:
+    """Records from before the last reboot are stale: their PIDs may belong to unrelated processes now."""
+    return record['started_at'] < psutil.boot_time()
+
+def is_job_alive(record: dict) -> bool:
+    """Returns True if the recorded job process itself is still running."""
+    return not started_before_boot(record) and is_pid_alive(record['pid'], record.get('pid_create_time'))
+
+def is_owner_alive(record: dict) -> bool:
+    return not started_before_boot(record) and is_pid_alive(record['owner_pid'])
+
+def refresh_process_record(record: dict) -> dict:
+    """
+    Marks a process as completed when neither it nor its owning worker is alive anymore,
+    so records left behind by a crashed worker or a reboot do not report as running forever.
+    """
+    if record['status'] == 'running' and not is_owner_alive(record) and not is_job_alive(record):
+        process_store.mark_finished(record['process_id'], record['returncode'])
+        record = process_store.get_process(record['process_id']) or record
+    return record
+
+def output_size(log_file_path: str, header_size: int) -> int:
+    try:
+        return os.path.getsize(log_file_path) - header_size
+    except OSError:
+        return 0
+
+async def run_long_command_to_log(command: str, process_id: str, limits: dict | None = None):
     """
     Runs a long-running command asynchronously.
     Writes the command, its output, and errors continuously to a log file in tmp/{process_id}.log.
+    The process is registered in the shared process store so any worker can report on or stop it.
+    Its process group is killed when it exceeds the timeout or output limit in limits; the output
+    limit is also applied as RLIMIT_FSIZE, which caps every file the job writes.
+    Resource usage of the process tree is sampled while it runs and kept in the store afterwards.
     """
-    os.makedirs('tmp', exist_ok=True)
-    log_file_path = f'tmp/{process_id}.log'
+    limits = limits or {}
+    os.makedirs(PROCESS_LOG_DIR, exist_ok=True)
+    log_file_path = os.path.join(PROCESS_LOG_DIR, f'{process_id}.log')
     with open(log_file_path, 'w') as log_file:
         log_file.write(f'Command: {command}\n')
         log_file.flush()
-        process = await asyncio.create_subprocess_shell(command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
-        running_processes[process_id] = {'process': process, 'log_file': log_file_path}
+        header_size = log_file.tell()
+        file_size_limit = header_size + limits['max_output_bytes'] if 'max_output_bytes' in limits else None
+        process = await asyncio.create_subprocess_shell(apply_ionice(command, limits), stdout=log_file, stderr=asyncio.subprocess.STDOUT,
+                                                        start_new_session=True, preexec_fn=build_preexec_fn(limits, file_size_limit))
+    running_processes[process_id] = {'process': process, 'log_file': log_file_path}
+    process_store.register_process(process_id, command, process.pid, log_file_path, limits, process_create_time(process.pid))
+    deadline = time.monotonic() + limits['timeout'] if 'timeout' in limits else None
+    reason = None
+    sampler = UsageSampler(process.pid)
+    usage_written_at = time.monotonic()
+    try:
+        while process.returncode is None:
+            try:
+                await asyncio.wait_for(process.wait(), timeout=STOP_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                usage_written_at = await record_usage(process_id, sampler, usage_written_at)
+                if process_store.stop_requested(process_id):
+                    reason = 'stopped'
+                elif deadline is not None and time.monotonic() >= deadline:
+                    reason = 'timeout'
+                elif 'max_output_bytes' in limits and output_size(log_file_path, header_size) > limits['max_output_bytes']:
+                    reason = 'output_limit'
+                if reason:
+                    logger.info(f'Terminating process {process_id}: {reason}')
+                    await terminate_process_group(process)
+        status = 'stopped' if process_store.stop_requested(process_id) else 'completed'
+        process_store.update_usage(process_id, sampler.usage())
+        process_store.mark_finished(process_id, process.returncode, status, termination_reason(process.returncode, reason))
+        search_index.request_refresh()
+    finally:
+        running_processes.pop(process_id, None)
+
+async def record_usage(process_id: str, sampler: UsageSampler, written_at: float) -> float:
+    """
+    Samples a job's usage and writes it to the store if USAGE_WRITE_INTERVAL has passed; returns the last write time.
+    Sampling walks the process tree through /proc, so it runs in a thread instead of on the event loop.
+    """
+    usage = await asyncio.to_thread(sampler.sample)
+    if time.monotonic() - written_at < USAGE_WRITE_INTERVAL:
+        return written_at
+    process_store.update_usage(process_id, usage)
+    return time.monotonic()
+
+def reap_process(pid: int, create_time: float | None = None):
+    """
+    Collects the exit status of a process that is still our child (e.g. after an in-place execv restart).
+    Returns (exited, returncode); returncode is None when the process is not our child. A process
+    that is not our child counts as exited once its PID is gone or belongs to a different process.
+    psutil's wait works the same on Windows, which has no os.WNOHANG.
+    """
+    if not is_pid_alive(pid, create_time):
+        return (True, None)
+    try:
+        returncode = psutil.Process(pid).wait(timeout=0)
+    except psutil.TimeoutExpired:
+        return (False, None)
+    except psutil.NoSuchProcess:
+        return (True, None)
+    return (True, None if returncode is None else int(returncode))
+
+async def monitor_adopted_process(process_id: str, pid: int, create_time: float | None = None, deadline: float | None = None, usage: dict | None = None):
+    """
+    Watches a process started by a previous server instance until it exits,
+    honouring stop requests made through the shared process store and the original timeout
+    (deadline is a time.time() timestamp). Usage sampling continues from the stored totals.
+    The PID is checked against create_time before every signal, so a reused PID is never signalled.
+    """
+    reason = None
+    term_sent_at = None
+    sampler = UsageSampler(pid, usage)
+    usage_written_at = time.monotonic()
+    try:
         while True:
-            line = await process.stdout.readline()
-            if not line:
-                if process.returncode is not None:
-                    break
-                await asyncio.sleep(0.1)
-                continue
-            log_file.write(line.decode())
-            log_file.flush()
-        await process.wait()
+            (exited, returncode) = reap_process(pid, create_time)
+            if exited:
+                status = 'stopped' if process_store.stop_requested(process_id) else 'completed'
+                process_store.update_usage(process_id, sampler.usage())
+                process_store.mark_finished(process_id, returncode, status, termination_reason(returncode, reason))
+                search_index.request_refresh()
+                return
+            if term_sent_at is None:
+                if process_store.stop_requested(process_id):
+                    reason = 'stopped'
+                elif deadline is not None and time.time() >= deadline:
+                    reason = 'timeout'
+                if reason:
+                    signal_process_group(pid, signal.SIGTERM)
+                    term_sent_at = time.monotonic()
+            elif time.monotonic() - term_sent_at >= kill_grace_period():
+                signal_process_group(pid, KILL_SIGNAL)
+            usage_written_at = await record_usage(process_id, sampler, usage_written_at)
+            await asyncio.sleep(STOP_POLL_INTERVAL)
+    finally:
+        running_processes.pop(process_id, None)
+
+def adopt_orphaned_processes():
+    """
+    Takes ownership of running processes whose owning worker has exited (or was replaced
+    in place by execv), so jobs started before a restart keep reporting status and logs.
+    """
+    for record in process_store.list_processes(status='running'):
+        process_id = record['process_id']
+        if process_id in running_processes:
+            continue
+        owner_pid = record['owner_pid']
+        if owner_pid != os.getpid() and is_owner_alive(record):
+            continue
+        if not process_store.adopt_process(process_id, owner_pid):
+            continue
+        if not is_job_alive(record):
+            logger.info(f'Background process {process_id} (PID {record["pid"]}) is no longer running; marking it finished')
+            process_store.mark_finished(process_id, None, 'completed', termination_reason(None))
+            continue
+        logger.info(f'Adopted background process {process_id} (PID {record["pid"]}) from worker {owner_pid}')
+        timeout = record['limits'].get('timeout')
+        deadline = record['started_at'] + timeout if timeout else None
+        create_time = record['pid_create_time']
+        task = asyncio.create_task(monitor_adopted_process(process_id, record['pid'], create_time, deadline, record))
+        running_processes[process_id] = {'process': None, 'pid': record['pid'], 'create_time': create_time, 'log_file': record['log_file'], 'task': task}
+
+async def adopt_orphaned_processes_loop():
+    """Periodically adopts orphaned processes; old workers may still be draining when this one starts."""
+    while True:
+        try:
+            adopt_orphaned_processes()
+        except Exception as e:
+            logger.error(f'Failed to adopt orphaned processes: {e}')
+        await asyncio.sleep(ADOPT_INTERVAL)
 
 def cleanup_processes():
-    """Terminates all running subprocesses on exit."""
-    for (process_id, proc_info) in running_processes.items():
+    """Terminates all subprocesses owned by this worker on exit."""
+    for (process_id, proc_info) in list(running_processes.items()):
         process = proc_info.get('process')
-        if process and process.returncode is None:
-            try:
-                process.terminate()
-            except Exception as e:
-                logger.error(f'Error terminating process {process_id}: {e}')
+        try:
+            if process and process.returncode is None:
+                signal_process_group(process.pid, signal.SIGTERM)
+                process_store.mark_finished(process_id, None, 'stopped', 'shutdown')
+            elif process is None and is_pid_alive(proc_info.get('pid'), proc_info.get('create_time')):
+                signal_process_group(proc_info['pid'], signal.SIGTERM)
+                process_store.mark_finished(process_id, None, 'stopped', 'shutdown')
+        except Exception as e:
+            logger.error(f'Error terminating process {process_id}: {e}')
     logger.info('All running subprocesses have been cleaned up.')
 
+def sync_working_directory():
+    """Applies the working directory shared between workers to this worker before handling a request."""
+    cwd = process_store.get_setting('cwd')
+    if cwd and cwd != os.getcwd() and os.path.isdir(cwd):
+        os.chdir(cwd)
+
 @router.post('/start-process')
 async def start_process(request: CommandRequest):
     """
     Starts a long-running process in the background.
-    Returns immediately with a success message and a unique process ID.
+    Returns immediately with a success message, a unique process ID and the enforced limits.
     """
     process_id = str(uuid.uuid4())
-    asyncio.create_task(run_long_command_to_log(request.command, process_id))
-    return {'message': 'Process started', 'process_id': process_id}
+    limits = resolve_limits(request, background=True)
+    asyncio.create_task(run_long_command_to_log(request.command, process_id, limits))
+    return {'message': 'Process started', 'process_id': process_id, 'limits': limits}
+
+async def wait_for_stop(process_id: str, timeout: float) -> dict:
+    """Polls the shared store until the owning worker has stopped the process or the timeout expires."""
+    deadline = time.monotonic() + timeout
+    record = process_store.get_process(process_id)
+    while record and record['status'] == 'running' and time.monotonic() < deadline:
+        await asyncio.sleep(STOP_POLL_INTERVAL / 2)
+        record = process_store.get_process(process_id)
+    return record
 
 @router.post('/stop-process/{process_id}')
 async def stop_process(process_id: str):
     """
     Stops a running process given its process ID and deletes its log file.
+    Processes owned by another worker are signalled through the shared process store.
     """
-    if process_id not in running_processes:
+    record = process_store.get_process(process_id)
+    if not record:
         raise HTTPException(status_code=404, detail='Process not found')
-    proc_info = running_processes[process_id]
-    process = proc_info.get('process')
-    log_file_path = proc_info.get('log_file')
-    if process and process.returncode is None:
-        process.terminate()
-        await process.wait()
+    log_file_path = record.get('log_file')
+    proc_info = running_processes.get(process_id)
+    if record['status'] == 'running':
+        process_store.request_stop(process_id)
+        if proc_info and proc_info['process'] and proc_info['process'].returncode is None:
+            await terminate_process_group(proc_info['process'])
+        else:
+            record = await wait_for_stop(process_id, STOP_TIMEOUT if is_owner_alive(record) else 0)
+            if record and record['status'] == 'running':
+                if is_job_alive(record):
+                    logger.warning(f'Owner of process {process_id} did not stop it; signalling PID {record["pid"]} directly')
+                    signal_process_group(record['pid'], signal.SIGTERM)
+                process_store.mark_finished(process_id, None, 'stopped', 'stopped')
     if log_file_path and os.path.exists(log_file_path):
         try:
             os.remove(log_file_path)
         except Exception as e:
             logger.error(f'Failed to remove log file for process {process_id}: {e}')
             raise HTTPException(status_code=500, detail=f'Failed to delete log file: {e}')
-    del running_processes[process_id]
+    process_store.delete_process(process_id)
     return {'message': 'Process terminated and log file deleted'}
 
 @router.post('/check-process-status/{process_id}')
 async def check_process_status(process_id: str):
     """
     Checks the status of a running process by reading its log file.
+    Also reports its resource usage (CPU seconds, peak RSS and IO bytes of the whole process tree, wall time).
     """
-    if process_id not in running_processes:
+    record = process_store.get_process(process_id)
+    if not record:
         raise HTTPException(status_code=404, detail='Process not found')
-    proc_info = running_processes[process_id]
-    process = proc_info.get('process')
-    log_file_path = proc_info.get('log_file')
+    record = refresh_process_record(record)
+    log_file_path = record.get('log_file')
     log_content = ''
     if os.path.exists(log_file_path):
         with open(log_file_path, 'r') as log_file:
             log_content = log_file.read()
     else:
         log_content = 'Log file not found'
-    if process and process.returncode is None:
+    if record['status'] == 'running':
         status_message = 'Process is still running'
         completed = False
     else:
         status_message = 'Process completed'
         completed = True
-    return {'message': status_message, 'log': log_content, 'completed': completed}
+    return {'message': status_message, 'log': log_content, 'completed': completed, 'returncode': record['returncode'],
+            'termination_reason': record['termination_reason'], 'limits': record['limits'], 'usage': usage_summary(record)}
 
 @router.post('/list-running-processes')
-async def list_processes():
+async def list_processes(sort_by: Optional[str] = None):
     """
-    Lists all processes tracked in the running_processes dictionary.
+    Lists all background processes tracked in the shared process store, across all workers,
+    with their resource usage. Pass sort_by (e.g. cpu_time, rss_peak, wall_time) to list the most expensive first.
     """
     process_list = []
-    for (process_id, proc_info) in running_processes.items():
-        process = proc_info.get('process')
-        status = 'running' if process and process.returncode is None else 'completed'
-        process_list.append({'process_id': process_id, 'status': status})
-    return {'processes': process_list}
\ No newline at end of file
+    for record in process_store.list_processes():
+        record = refresh_process_record(record)
+        status = 'running' if record['status'] == 'running' else 'completed'
+        process_list.append({'process_id': record['process_id'], 'command': record['command'], 'status': status,
+                             'termination_reason': record['termination_reason'], 'usage': usage_summary(record)})
+    if sort_by:
+        if process_list and sort_by not in process_list[0]['usage']:
+            raise HTTPException(status_code=400, detail=f'Cannot sort by {sort_by}')
+        process_list.sort(key=lambda p: p['usage'][sort_by], reverse=True)
+    return {'processes': process_list}
@@ -0,0 +1,84 @@
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logger import setup_logger
+from responses import dumps_json
+
+access_logger = setup_logger('access', 'access.log', fmt='%(message)s', console=False)
+_current_timing: ContextVar = ContextVar('request_timing', default=None)
+
+class RequestTiming:
+    """Stage durations (ms) collected for one request; repeated stages are summed."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+
+    def add(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds * 1000
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> bytes:
+        metrics = [f'{name};dur={duration:.2f}' for (name, duration) in self.spans.items()]
+        metrics.append(f'total;dur={self.elapsed_ms():.2f}')
+        return ', '.join(metrics).encode('latin-1')
+
+@contextmanager
+def span(name: str):
+    """
+    Times a stage of the current request (e.g. 'auth', 'file_read', 'spawn').
+    Outside of an instrumented request this only costs a context variable lookup.
+    """
+    timing = _current_timing.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - start)
+
+class TimingMiddleware:
+    """
+    ASGI middleware that collects span timings for every request, reports them in a Server-Timing
+    response header and writes a JSON access log line to logs/access.log.
+    Only a sample of requests is logged (log_sample_rate), plus every request slower than slow_ms.
+    """
+
+    def __init__(self, app, log_sample_rate: float = 0.1, slow_ms: float = 500):
+        self.app = app
+        self.log_sample_rate = log_sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        timing = RequestTiming()
+        token = _current_timing.set(timing)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', timing.server_timing()))
+                message = {**message, 'headers': headers}
+            await send(message)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_timing.reset(token)
+            duration_ms = timing.elapsed_ms()
+            if duration_ms >= self.slow_ms or random.random() < self.log_sample_rate:
+                access_logger.info(dumps_json({
+                    'ts': round(time.time(), 3), 'pid': os.getpid(), 'method': scope['method'], 'path': scope['path'],
+                    'status': status, 'duration_ms': round(duration_ms, 2),
+                    'spans': {name: round(duration, 2) for (name, duration) in timing.spans.items()},
+                }).decode())
@@ -1,11 +1,25 @@
 import os
+import time
+import hashlib
+import shutil
 import aiofiles
 import ast
+from collections import OrderedDict
 from pathlib import Path
 from logger import system_logger  # Import the logger
+import search_index
+from timing import span
 
 logger = system_logger
 
+# Recently read files, keyed by path and validated against their stat on every read
+READ_CACHE_MAX_BYTES = 64 * 1024 * 1024
+READ_CACHE_MAX_FILE_BYTES = 4 * 1024 * 1024
+# Files modified this recently are not cached: a second write within the same mtime tick could go unnoticed
+READ_CACHE_RACY_NS = 2 * 10**9
+_read_cache = OrderedDict()
+_read_cache_bytes = 0
+
 class FunctionReplacer(ast.NodeTransformer):
     def __init__(self, target_name: str, new_node: ast.FunctionDef):
         self.target_name = target_name
@@ -35,9 +49,56 @@ def resolve_path(filepath: str) -> Path:
         return Path("/mnt/" + path.drive.lower().replace(':', '') + path.as_posix()[2:])
     return path
 
+def content_etag(content: str) -> str:
+    """Returns a strong ETag for file content, used for If-None-Match conditional reads."""
+    return '"' + hashlib.blake2b(content.encode("utf-8", errors="surrogatepass"), digest_size=16).hexdigest() + '"'
+
+def stat_etag(stat: os.stat_result) -> str:
+    """Returns a weak ETag built from stat metadata, for files too large to keep in the read cache."""
+    return f'W/"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+def _etag_from_stat(path: str, stat: os.stat_result):
+    """
+    Returns a file's ETag when it is known without reading the file: the cached content hash, or
+    a stat-based ETag for files too large to cache. Recently modified files need their content hashed.
+    """
+    if stat.st_size > READ_CACHE_MAX_FILE_BYTES:
+        return None if time.time_ns() - stat.st_mtime_ns < READ_CACHE_RACY_NS else stat_etag(stat)
+    cached = _read_cache.get(path)
+    if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size, stat.st_ino):
+        return cached[3]
+    return None
+
+def peek_etag(file_path: str):
+    """Returns the ETag a read of the file would return if it can be told from its stat alone, else None."""
+    resolved_path = str(resolve_path(file_path))
+    try:
+        return _etag_from_stat(resolved_path, os.stat(resolved_path))
+    except OSError:
+        return None
+
+def invalidate_read_cache(path):
+    global _read_cache_bytes
+    entry = _read_cache.pop(str(path), None)
+    if entry is not None:
+        _read_cache_bytes -= entry[1]
+
+def _cache_read(path: str, stat: os.stat_result, content: str, etag: str):
+    global _read_cache_bytes
+    invalidate_read_cache(path)
+    if stat.st_size > READ_CACHE_MAX_FILE_BYTES or time.time_ns() - stat.st_mtime_ns < READ_CACHE_RACY_NS:
+        return
+    _read_cache[path] = ((stat.st_mtime_ns, stat.st_size, stat.st_ino), stat.st_size, content, etag)
+    _read_cache_bytes += stat.st_size
+    while _read_cache_bytes > READ_CACHE_MAX_BYTES:
+        (_, evicted) = _read_cache.popitem(last=False)
+        _read_cache_bytes -= evicted[1]
+
 async def read_file(file_path: str):
     """
     Reads the entire content of the specified file asynchronously.
+    Unchanged files (same mtime, size and inode) are served from an in-memory cache.
+    Files too large for the cache get a weak, stat-based ETag instead of a content hash.
     """
     resolved_path = resolve_path(file_path)
     if not resolved_path.exists():
@@ -45,10 +106,20 @@ async def read_file(file_path: str):
         return {"error": "File not found"}
 
     try:
-        async with aiofiles.open(resolved_path, "r", encoding="utf-8") as f:
-            content = await f.read()
-        logger.info(f"Read file successfully: {resolved_path}")
-        return {"file": str(resolved_path), "content": content}
+        with span("file_read"):
+            stat = os.stat(resolved_path)
+            cached = _read_cache.get(str(resolved_path))
+            if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size, stat.st_ino):
+                _read_cache.move_to_end(str(resolved_path))
+                (_, _, content, etag) = cached
+            else:
+                async with aiofiles.open(resolved_path, "r", encoding="utf-8") as f:
+                    content = await f.read()
+                etag = _etag_from_stat(str(resolved_path), stat) or content_etag(content)
+                _cache_read(str(resolved_path), stat, content, etag)
+        with span("log"):
+            logger.info(f"Read file successfully: {resolved_path}")
+        return {"file": str(resolved_path), "content": content, "etag": etag}
     except Exception as e:
         logger.error(f"Read error in {resolved_path}: {str(e)}")
         return {"error": f"Read error: {str(e)}"}
@@ -59,14 +130,54 @@ async def write_file(file_path: str, content: str):
     """
     resolved_path = resolve_path(file_path)
     try:
-        async with aiofiles.open(resolved_path, "w", encoding="utf-8") as f:
-            await f.write(content)
-        logger.info(f"File written successfully: {resolved_path}")
+        with span("file_write"):
+            async with aiofiles.open(resolved_path, "w", encoding="utf-8") as f:
+                await f.write(content)
+        search_index.notify_changed(resolved_path)
+        invalidate_read_cache(resolved_path)
+        with span("log"):
+            logger.info(f"File written successfully: {resolved_path}")
         return {"message": f"File '{resolved_path}' saved successfully"}
     except Exception as e:
         logger.error(f"Write error in {resolved_path}: {str(e)}")
         return {"error": f"Write error: {str(e)}"}
 
+async def write_stream(file_path: str, chunks, append: bool = False):
+    """
+    Streams chunks of bytes to the specified file so memory use stays at one chunk.
+    New files are written to a temporary file next to the target and renamed into place.
+    resolve_path follows symlinks, so a link keeps pointing at the replaced file, and an
+    existing file keeps its permission bits (e.g. an executable script stays executable).
+    Only disk errors are returned as {"error": ...}; errors raised by chunks, such as a malformed
+    upload body, propagate to the caller once the temporary file is removed.
+    """
+    resolved_path = resolve_path(file_path)
+    tmp_path = resolved_path.with_name(f".{resolved_path.name}.upload-{os.getpid()}-{id(chunks)}")
+    target = resolved_path if append else tmp_path
+    written = 0
+    try:
+        with span("file_write"):
+            async with aiofiles.open(target, "ab" if append else "wb") as f:
+                async for chunk in chunks:
+                    if chunk:
+                        await f.write(chunk)
+                        written += len(chunk)
+        if not append:
+            if resolved_path.exists():
+                shutil.copymode(resolved_path, tmp_path)
+            os.replace(tmp_path, resolved_path)
+        search_index.notify_changed(resolved_path)
+        invalidate_read_cache(resolved_path)
+        logger.info(f"Streamed {written} bytes to file: {resolved_path}")
+        return {"message": f"File '{resolved_path}' saved successfully", "bytes_written": written}
+    except BaseException as e:
+        if not append and tmp_path.exists():
+            tmp_path.unlink()
+        if not isinstance(e, OSError):
+            raise
+        logger.error(f"Streamed write error in {resolved_path}: {str(e)}")
+        return {"error": f"Write error: {str(e)}"}
+
 async def append_file(file_path: str, content):
     """
     Appends content to the specified file asynchronously.
@@ -82,6 +193,8 @@ async def append_file(file_path: str, content):
                 await f.writelines([line + "\n" for line in content])
             else:
                 await f.write(content + "\n")
+        search_index.notify_changed(resolved_path)
+        invalidate_read_cache(resolved_path)
         logger.info(f"Appended content to file: {resolved_path}")
         return {"message": f"Content appended to '{resolved_path}' successfully"}
     except Exception as e:
@@ -152,12 +265,14 @@ async def replace_func(file_path: str, function_name: str, new_function_code: st
         return {"error": "File not found"}
     content = file_data["content"]
     try:
-        tree = ast.parse(content)
+        with span("ast_parse"):
+            tree = ast.parse(content)
     except Exception as e:
         logger.error(f"Error parsing source file {file_path}: {str(e)}")
         return {"error": f"Error parsing source file: {str(e)}"}
     try:
-        new_tree = ast.parse(new_function_code)
+        with span("ast_parse"):
+            new_tree = ast.parse(new_function_code)
         new_func_node = next((node for node in new_tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))), None)
         if not new_func_node:
             logger.error("No function definition found in new function code")
@@ -167,13 +282,15 @@ async def replace_func(file_path: str, function_name: str, new_function_code: st
         return {"error": f"Error parsing new function code: {str(e)}"}
     
     replacer = FunctionReplacer(function_name, new_func_node)
-    modified_tree = replacer.visit(tree)
-    ast.fix_missing_locations(modified_tree)
+    with span("ast_transform"):
+        modified_tree = replacer.visit(tree)
+        ast.fix_missing_locations(modified_tree)
     if not replacer.replaced:
         logger.error(f"Function '{function_name}' not found in {file_path}")
         return {"error": f"Function '{function_name}' not found in the source file."}
     try:
-        new_source = ast.unparse(modified_tree)
+        with span("ast_unparse"):
+            new_source = ast.unparse(modified_tree)
     except Exception as e:
         try:
             import astunparse
@@ -195,7 +312,8 @@ async def read_func(filepath: str, function_name: str):
     
     content = file_data["content"]
     try:
-        tree = ast.parse(content)
+        with span("ast_parse"):
+            tree = ast.parse(content)
         for node in tree.body:
             if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == function_name:
                 logger.info(f"Read function '{function_name}' from {filepath}")
@@ -0,0 +1,65 @@
+import os
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from schemas import ListDirectoryRequest
+from responses import dumps_json
+from utils import resolve_path
+import watcher
+
+router = APIRouter()
+MAX_LONG_POLL_SECONDS = 60
+SSE_KEEPALIVE_SECONDS = 15
+
+@router.post("/list-directory")
+async def list_directory(request: ListDirectoryRequest):
+    """
+    Lists a directory (optionally recursively) with type, size and mtime for every entry.
+    Paths under WATCH_ROOTS are served from the watcher's cached tree without touching the disk
+    when this worker is the one watching them.
+    """
+    resolved_path = resolve_path(request.path)
+    if not resolved_path.is_dir():
+        raise HTTPException(status_code=404, detail="Directory not found")
+    return await watcher.list_directory(str(resolved_path), request.recursive, request.max_entries)
+
+def get_change_log():
+    if watcher.changes is None:
+        raise HTTPException(status_code=400, detail="No directories are watched; set WATCH_ROOTS to enable change events")
+    return watcher.changes
+
+def resolve_under(path: Optional[str]):
+    return os.path.abspath(str(resolve_path(path))) if path else None
+
+@router.get("/watch/events")
+async def watch_events(cursor: Optional[str] = None, path: Optional[str] = None, timeout: float = 30):
+    """
+    Long-polls for file changes under the watched roots (optionally only under path).
+    Call without a cursor to get the current one, then pass the returned cursor on every call.
+    reset=true means events were missed (or watching moved to another worker or server): re-list and continue.
+    """
+    changes = get_change_log()
+    (events, reset, current) = await changes.wait(cursor, resolve_under(path), min(max(timeout, 0), MAX_LONG_POLL_SECONDS))
+    return {"cursor": current, "events": events, "reset": reset}
+
+async def stream_events(changes, cursor: str, under: Optional[str]):
+    while True:
+        (events, reset, current) = await changes.wait(cursor, under, SSE_KEEPALIVE_SECONDS)
+        if reset:
+            yield f"event: reset\nid: {current}\ndata: {{}}\n\n".encode()
+        epoch = current.partition(":")[0]
+        for event in events:
+            yield b"id: " + f"{epoch}:{event['seq']}".encode() + b"\ndata: " + dumps_json(event) + b"\n\n"
+        if not events and not reset:
+            yield b": keep-alive\n\n"
+        cursor = current
+
+@router.get("/watch/stream")
+async def watch_stream(cursor: Optional[str] = None, path: Optional[str] = None, last_event_id: Optional[str] = Header(None)):
+    """
+    Pushes file changes under the watched roots as Server-Sent Events.
+    Reconnecting clients resume from Last-Event-ID; a 'reset' event means changes were missed.
+    """
+    changes = get_change_log()
+    return StreamingResponse(stream_events(changes, last_event_id or cursor or changes.cursor, resolve_under(path)),
+                             media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
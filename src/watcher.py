@@ -0,0 +1,587 @@
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import stat as stat_module
+import struct
+import sys
+import time
+import uuid
+from logger import system_logger
+from search import ALWAYS_SKIPPED_DIRS
+import process_store
+
+try:
+    import fcntl
+except ImportError:  # Windows: every worker watches on its own
+    fcntl = None
+
+logger = system_logger
+
+DEFAULT_POLL_SECONDS = 2
+EVENT_BUFFER_SIZE = 10000
+READ_SIZE = 64 * 1024
+# How often workers check the shared store for new events, and retry becoming the watching worker
+STORE_POLL_SECONDS = 0.25
+LEADER_RETRY_SECONDS = 2
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+EVENT_HEADER = struct.Struct('iIII')
+
+def entry_for(st: os.stat_result) -> dict:
+    """Stat metadata kept in the cached tree for one directory entry."""
+    if stat_module.S_ISDIR(st.st_mode):
+        kind = 'dir'
+    elif stat_module.S_ISREG(st.st_mode):
+        kind = 'file'
+    elif stat_module.S_ISLNK(st.st_mode):
+        kind = 'symlink'
+    else:
+        kind = 'other'
+    return {'type': kind, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def scan_tree(root: str, add_watch=None) -> dict:
+    """
+    Walks root (without following symlinks) into {directory: {name: entry}}.
+    add_watch is called for every directory before it is listed, so no change can slip in between.
+    """
+    tree = {}
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        if add_watch is not None:
+            add_watch(directory)
+        entries = {}
+        try:
+            with os.scandir(directory) as it:
+                for item in it:
+                    try:
+                        entry = entry_for(item.stat(follow_symlinks=False))
+                    except OSError:
+                        continue
+                    entries[item.name] = entry
+                    if entry['type'] == 'dir' and item.name not in ALWAYS_SKIPPED_DIRS:
+                        stack.append(item.path)
+        except OSError:
+            continue
+        tree[directory] = entries
+    return tree
+
+class Inotify:
+    """Minimal ctypes binding to Linux inotify(7)."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.fd = fd
+
+    def add_watch(self, path: str) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(WATCH_MASK))
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> list:
+        """Drains the queue into (wd, mask, name) tuples."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                (wd, mask, _, name_len) = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + name_len].rstrip(b'\0'))
+                offset += name_len
+                events.append((wd, mask, name))
+
+    def close(self):
+        os.close(self.fd)
+
+class ChangeLog:
+    """
+    Sequence-numbered change events shared by all workers through the state store. Only the worker
+    holding the watch lock runs the watchers and publishes events (record/flush); every worker reads them.
+    Cursors are '<epoch>:<seq>'. The epoch changes whenever a worker takes over watching, since changes
+    may have been missed in between, so a cursor from an older epoch is answered with reset.
+    """
+
+    def __init__(self, size: int = EVENT_BUFFER_SIZE):
+        self.size = size
+        self._pending = {}
+        self._changed = asyncio.Event()
+        self._poll_task = None
+
+    def current(self) -> tuple:
+        return (process_store.get_setting('watch_epoch') or '', process_store.last_watch_event_seq())
+
+    @property
+    def cursor(self) -> str:
+        (epoch, seq) = self.current()
+        return f'{epoch}:{seq}'
+
+    def begin_epoch(self):
+        """Called by the worker that starts watching; invalidates the cursors handed out before."""
+        process_store.set_setting('watch_epoch', uuid.uuid4().hex[:12])
+        self._notify()
+
+    def record(self, kind: str, path: str, entry: dict | None):
+        """Queues an event; repeated events for a path are merged until the next flush."""
+        previous = self._pending.pop(path, None)
+        if previous is not None and previous['type'] == 'created' and kind == 'modified':
+            kind = 'created'
+        elif previous is not None and previous['type'] == 'created' and kind == 'deleted':
+            return
+        self._pending[path] = {'type': kind, 'path': path, 'entry': entry}
+
+    def flush(self):
+        if not self._pending:
+            return
+        events = list(self._pending.values())
+        self._pending.clear()
+        process_store.append_watch_events(events, self.size)
+        self._notify()
+
+    def _notify(self):
+        (changed, self._changed) = (self._changed, asyncio.Event())
+        changed.set()
+
+    def start_polling(self):
+        """Wakes this worker's waiters when another worker publishes events."""
+        self._poll_task = asyncio.create_task(self._poll_loop())
+
+    def stop_polling(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+
+    async def _poll_loop(self):
+        seen = None
+        while True:
+            try:
+                current = self.current()
+                if current != seen:
+                    if seen is not None:
+                        self._notify()
+                    seen = current
+            except Exception as e:
+                logger.error(f'Failed to read change events: {e}')
+            await asyncio.sleep(STORE_POLL_SECONDS)
+
+    def since(self, cursor: str | None, under: str | None = None) -> tuple:
+        """
+        Returns (events after cursor, reset, new cursor); reset means events were lost and the client
+        should re-list. Without a cursor only the current cursor is returned.
+        """
+        (epoch, last_seq) = self.current()
+        current = f'{epoch}:{last_seq}'
+        if not cursor:
+            return ([], False, current)
+        (cursor_epoch, _, seq) = cursor.partition(':')
+        if cursor_epoch != epoch or not seq.isdigit() or int(seq) > last_seq:
+            return ([], True, current)
+        seq = int(seq)
+        if seq == last_seq:
+            return ([], False, current)
+        (events, oldest) = process_store.watch_events_since(seq)
+        if oldest is None or seq < oldest - 1:
+            return ([], True, current)
+        prefix = os.path.join(under, '') if under else None
+        matching = [event for event in events if prefix is None or event['path'] == under or event['path'].startswith(prefix)]
+        return (matching, False, f'{epoch}:{events[-1]["seq"]}' if events else current)
+
+    async def wait(self, cursor: str | None, under: str | None, timeout: float) -> tuple:
+        """Long-polls until events after cursor arrive or timeout expires; returns (events, reset, cursor)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            changed = self._changed
+            (events, reset, current) = self.since(cursor, under)
+            remaining = deadline - time.monotonic()
+            if not cursor or events or reset or remaining <= 0:
+                return (events, reset, current)
+            cursor = current
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+class DirectoryWatcher:
+    """
+    Keeps a cached tree of one root with stat metadata for every entry, updated from inotify
+    events on Linux and by periodic rescans elsewhere (or when inotify runs out of watches).
+    """
+
+    def __init__(self, root: str, changes: ChangeLog, poll_seconds: float = DEFAULT_POLL_SECONDS, use_inotify: bool = True):
+        self.root = os.path.abspath(root)
+        self.changes = changes
+        self.poll_seconds = poll_seconds
+        self.use_inotify = use_inotify and sys.platform.startswith('linux')
+        self.dirs = {}
+        self.ready = False
+        self.mode = None
+        self._inotify = None
+        self._wd_to_dir = {}
+        self._dir_to_wd = {}
+        self._poll_task = None
+        self._rescan_task = None
+        # Directories that appeared after startup and are being scanned, with the events that arrived for them meanwhile
+        self._scanning = {}
+        self._scan_tasks = set()
+
+    def covers(self, path: str) -> bool:
+        return path == self.root or path.startswith(os.path.join(self.root, ''))
+
+    async def start(self):
+        if self.use_inotify:
+            try:
+                self._inotify = Inotify()
+                self.dirs = await asyncio.to_thread(scan_tree, self.root, self._add_watch)
+                asyncio.get_running_loop().add_reader(self._inotify.fd, self._on_readable)
+                self.mode = 'inotify'
+            except OSError as e:
+                logger.warning(f'inotify unavailable for {self.root} ({e}); falling back to polling every {self.poll_seconds}s')
+                self._close_inotify()
+        if self.mode is None:
+            self.dirs = await asyncio.to_thread(scan_tree, self.root)
+            self._poll_task = asyncio.create_task(self._poll_loop())
+            self.mode = 'polling'
+        self.ready = True
+        logger.info(f'Watching {self.root} ({self.mode}, {len(self.dirs)} directories)')
+
+    def stop(self):
+        if self._inotify is not None:
+            asyncio.get_running_loop().remove_reader(self._inotify.fd)
+            self._close_inotify()
+        for task in (self._poll_task, self._rescan_task, *self._scan_tasks):
+            if task is not None:
+                task.cancel()
+
+    def _close_inotify(self):
+        if self._inotify is not None:
+            self._inotify.close()
+        self._inotify = None
+        self._wd_to_dir.clear()
+        self._dir_to_wd.clear()
+
+    def _add_watch(self, directory: str):
+        inotify = self._inotify
+        if inotify is None:
+            return  # switched to polling while a scan was running
+        try:
+            wd = inotify.add_watch(directory)
+        except (FileNotFoundError, NotADirectoryError):
+            return  # removed before it could be watched; the scan skips it as well
+        self._wd_to_dir[wd] = directory
+        self._dir_to_wd[directory] = wd
+
+    def _switch_to_polling(self, reason):
+        if self._inotify is None:
+            return
+        logger.warning(f'Watching {self.root} by polling from now on: {reason}')
+        asyncio.get_running_loop().remove_reader(self._inotify.fd)
+        self._close_inotify()
+        self.mode = 'polling'
+        self._poll_task = asyncio.create_task(self._poll_loop())
+
+    def _on_readable(self):
+        try:
+            events = self._inotify.read_events()
+            touched = set()
+            for (wd, mask, name) in events:
+                if mask & IN_Q_OVERFLOW:
+                    self._schedule_rescan()
+                    continue
+                if mask & IN_IGNORED:
+                    directory = self._wd_to_dir.pop(wd, None)
+                    if directory is not None and self._dir_to_wd.get(directory) == wd:
+                        del self._dir_to_wd[directory]
+                    continue
+                directory = self._wd_to_dir.get(wd)
+                if directory is None or not name:
+                    continue  # events on the directory itself are reported by its parent
+                self._refresh_entry(directory, name)
+                touched.add(directory)
+            for directory in touched:
+                self._refresh_directory_stat(directory)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                self._switch_to_polling('inotify watch limit reached (fs.inotify.max_user_watches)')
+            else:
+                logger.error(f'inotify error for {self.root}: {e}')
+                self._schedule_rescan()
+        self.changes.flush()
+
+    def _refresh_entry(self, directory: str, name: str):
+        """Re-stats one entry after an inotify event and records what changed."""
+        entries = self.dirs.get(directory)
+        if entries is None:
+            self._defer_event(directory, name)
+            return
+        path = os.path.join(directory, name)
+        old = entries.get(name)
+        try:
+            new = entry_for(os.lstat(path))
+        except OSError:
+            new = None
+        if new is None:
+            if old is not None:
+                del entries[name]
+                if old['type'] == 'dir':
+                    self._drop_subtree(path)
+                self.changes.record('deleted', path, old)
+            return
+        entries[name] = new
+        if old is None or old['type'] != new['type']:
+            if old is not None and old['type'] == 'dir':
+                self._drop_subtree(path)
+            self.changes.record('created', path, new)
+            if new['type'] == 'dir' and name not in ALWAYS_SKIPPED_DIRS:
+                self._scan_subtree(path)
+        elif old != new and new['type'] != 'dir':
+            self.changes.record('modified', path, new)
+
+    def _refresh_directory_stat(self, directory: str):
+        """Keeps a directory's own cached mtime current after changes inside it; this is not reported as an event."""
+        (parent, name) = os.path.split(directory)
+        entries = self.dirs.get(parent)
+        if entries is None or name not in entries:
+            return
+        try:
+            entries[name] = entry_for(os.lstat(directory))
+        except OSError:
+            pass
+
+    def _scan_subtree(self, path: str):
+        """
+        Watches and scans a directory that appeared after startup. The scan runs in a thread, so a large
+        new tree (a git clone, an npm install) does not block the event loop; its contents are reported as created.
+        """
+        if path in self._scanning:
+            return
+        self._scanning[path] = []
+        task = asyncio.create_task(self._add_subtree(path))
+        self._scan_tasks.add(task)
+        task.add_done_callback(self._scan_tasks.discard)
+
+    def _defer_event(self, directory: str, name: str):
+        """Keeps an event for a directory whose scan is still running; it is replayed once the scan is merged."""
+        for (root, deferred) in self._scanning.items():
+            if directory == root or directory.startswith(os.path.join(root, '')):
+                deferred.append((directory, name))
+                return
+
+    async def _add_subtree(self, path: str):
+        add_watch = self._add_watch if self._inotify is not None else None
+        try:
+            subtree = await asyncio.to_thread(scan_tree, path, add_watch)
+        except OSError as e:
+            if self._inotify is not None and e.errno == errno.ENOSPC:
+                self._switch_to_polling('inotify watch limit reached (fs.inotify.max_user_watches)')
+            else:
+                logger.error(f'Scan of new directory {path} failed: {e}')
+            return
+        finally:
+            deferred = self._scanning.pop(path, [])
+        (parent, name) = os.path.split(path)
+        current = self.dirs.get(parent, {}).get(name)
+        if current is None or current['type'] != 'dir':
+            return  # removed again while it was being scanned
+        for (directory, entries) in subtree.items():
+            self.dirs[directory] = entries
+            for (name, entry) in entries.items():
+                self.changes.record('created', os.path.join(directory, name), entry)
+        for (directory, name) in deferred:
+            self._refresh_entry(directory, name)
+        self.changes.flush()
+
+    def _drop_subtree(self, path: str):
+        prefix = os.path.join(path, '')
+        for directory in [d for d in self.dirs if d == path or d.startswith(prefix)]:
+            del self.dirs[directory]
+            wd = self._dir_to_wd.pop(directory, None)
+            if wd is not None and self._inotify is not None:
+                self._wd_to_dir.pop(wd, None)
+                self._inotify.rm_watch(wd)
+
+    def _schedule_rescan(self):
+        if self._rescan_task is None or self._rescan_task.done():
+            self._rescan_task = asyncio.create_task(self.rescan())
+
+    async def rescan(self):
+        """Rebuilds the tree from disk and records the differences as events (polling mode and inotify overflow)."""
+        add_watch = self._add_watch if self._inotify is not None else None
+        try:
+            tree = await asyncio.to_thread(scan_tree, self.root, add_watch)
+        except OSError as e:
+            if self._inotify is not None and e.errno == errno.ENOSPC:
+                self._switch_to_polling('inotify watch limit reached (fs.inotify.max_user_watches)')
+                return
+            raise
+        for directory in set(self.dirs) | set(tree):
+            old_entries = self.dirs.get(directory, {})
+            new_entries = tree.get(directory, {})
+            for name in old_entries.keys() - new_entries.keys():
+                self.changes.record('deleted', os.path.join(directory, name), old_entries[name])
+            for (name, entry) in new_entries.items():
+                old = old_entries.get(name)
+                if old is None:
+                    self.changes.record('created', os.path.join(directory, name), entry)
+                elif old != entry and entry['type'] != 'dir':
+                    self.changes.record('modified', os.path.join(directory, name), entry)
+        self.dirs = tree
+        self.changes.flush()
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                await self.rescan()
+            except Exception as e:
+                logger.error(f'Rescan of {self.root} failed: {e}')
+
+    def list_directory(self, path: str, recursive: bool, max_entries: int):
+        """Lists a directory from the cached tree; returns None if it is not (or not yet) in the cache."""
+        if not self.ready or path not in self.dirs:
+            return None
+        directories = [path]
+        if recursive:
+            prefix = os.path.join(path, '')
+            directories += sorted(d for d in self.dirs if d.startswith(prefix))
+        entries = []
+        for directory in directories:
+            for (name, entry) in sorted(self.dirs.get(directory, {}).items()):
+                if len(entries) >= max_entries:
+                    return (entries, True)
+                entries.append(format_entry(os.path.join(directory, name), path, entry))
+        return (entries, False)
+
+def format_entry(full_path: str, listed: str, entry: dict) -> dict:
+    return {'path': os.path.relpath(full_path, listed), 'type': entry['type'], 'size': entry['size'],
+            'mtime': entry['mtime_ns'] / 1e9}
+
+def list_directory_uncached(path: str, recursive: bool, max_entries: int) -> tuple:
+    """Lists a directory straight from disk for paths outside the watched roots."""
+    entries = []
+    stack = [path]
+    while stack:
+        directory = stack.pop(0)
+        try:
+            with os.scandir(directory) as it:
+                items = sorted(it, key=lambda item: item.name)
+        except OSError:
+            continue
+        subdirectories = []
+        for item in items:
+            try:
+                entry = entry_for(item.stat(follow_symlinks=False))
+            except OSError:
+                continue
+            if len(entries) >= max_entries:
+                return (entries, True)
+            entries.append(format_entry(item.path, path, entry))
+            if recursive and entry['type'] == 'dir' and item.name not in ALWAYS_SKIPPED_DIRS:
+                subdirectories.append(item.path)
+        stack = subdirectories + stack
+    return (entries, False)
+
+changes = None
+_watchers = []
+_tasks = []
+_lock_file = None
+
+def acquire_watch_lock() -> bool:
+    """
+    Makes this worker the one that watches the roots, if no other worker is. The lock is an flock
+    next to the state database, released when the worker exits, so another worker can take over.
+    """
+    global _lock_file
+    if fcntl is None:
+        return True
+    lock_file = open(os.path.join(os.path.dirname(process_store.db_path()), 'watch.lock'), 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _lock_file = lock_file
+    return True
+
+async def watch_when_elected(roots: list, poll_seconds: float, use_inotify: bool):
+    """
+    Waits until this worker holds the watch lock, then starts a watcher for each root. Only one worker
+    spends inotify watches and publishes events; the others serve events from the shared store.
+    """
+    while not acquire_watch_lock():
+        await asyncio.sleep(LEADER_RETRY_SECONDS)
+    changes.begin_epoch()
+    for root in roots:
+        watcher = DirectoryWatcher(root, changes, poll_seconds, use_inotify)
+        _watchers.append(watcher)
+        try:
+            await watcher.start()
+        except Exception as e:
+            logger.error(f'Failed to watch {watcher.root}: {e}')
+
+async def start(roots: list, poll_seconds: float = DEFAULT_POLL_SECONDS, use_inotify: bool = True):
+    """Starts serving change events; the initial scans run in the background so startup is not delayed."""
+    global changes
+    changes = ChangeLog()
+    changes.start_polling()
+    _tasks.append(asyncio.create_task(watch_when_elected(roots, poll_seconds, use_inotify)))
+
+def stop():
+    global _lock_file
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()
+    for watcher in _watchers:
+        watcher.stop()
+    _watchers.clear()
+    if changes is not None:
+        changes.stop_polling()
+    if _lock_file is not None:
+        _lock_file.close()
+        _lock_file = None
+
+def find_watcher(path: str):
+    for watcher in _watchers:
+        if watcher.covers(path):
+            return watcher
+    return None
+
+async def list_directory(path: str, recursive: bool = False, max_entries: int = 5000) -> dict:
+    """Lists a directory with stat metadata, from the watch cache when it covers the path."""
+    path = os.path.abspath(path)
+    watcher = find_watcher(path)
+    result = watcher.list_directory(path, recursive, max_entries) if watcher else None
+    cached = result is not None
+    if result is None:
+        result = await asyncio.to_thread(list_directory_uncached, path, recursive, max_entries)
+    (entries, truncated) = result
+    return {'path': path, 'entries': entries, 'truncated': truncated, 'cached': cached}
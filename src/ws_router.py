@@ -0,0 +1,207 @@
+import asyncio
+import base64
+import codecs
+from importlib import import_module
+from urllib.parse import urlencode
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from auth import authenticate_websocket
+from logger import system_logger
+from responses import dumps_json, loads_json
+
+logger = system_logger
+router = APIRouter()
+# Bodies larger than this are sent as a stream of chunk frames so other responses can interleave
+WS_FRAME_SIZE = 64 * 1024
+WS_MAX_CONCURRENCY = 32
+
+def get_app():
+    """Dynamically import the main FastAPI app to prevent circular imports."""
+    app_module = import_module("main")
+    return getattr(app_module, "app", None)
+
+def build_scope(websocket: WebSocket, message: dict, api_key: str) -> tuple:
+    """Translates an RPC message into an HTTP scope and request body for the in-process app."""
+    method = message.get("method", "POST").upper()
+    path = message["path"]
+    query = message.get("query") or {}
+    headers = {name.lower(): str(value) for (name, value) in (message.get("headers") or {}).items()}
+    headers.pop("accept-encoding", None)
+    headers["authorization"] = f"Bearer {api_key}"
+    if "body_b64" in message:
+        body = base64.b64decode(message["body_b64"], validate=True)
+        headers.setdefault("content-type", "application/octet-stream")
+    elif "body" in message:
+        body = dumps_json(message["body"])
+        headers.setdefault("content-type", "application/json")
+    else:
+        body = b""
+    headers["content-length"] = str(len(body))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "https" if websocket.scope.get("scheme") == "wss" else "http",
+        "path": path,
+        "raw_path": path.encode("utf-8"),
+        "query_string": urlencode(query, doseq=True).encode("latin-1"),
+        "root_path": websocket.scope.get("root_path", ""),
+        "headers": [(name.encode("latin-1"), value.encode("latin-1")) for (name, value) in headers.items()],
+        "client": websocket.scope.get("client"),
+        "server": websocket.scope.get("server"),
+        "state": dict(websocket.scope.get("state") or {}),
+        "extensions": {},
+    }
+    return (scope, body)
+
+def encode_body(request_id, body: bytes, content_type: str) -> dict:
+    """Embeds a complete response body in a frame: JSON as-is, text as a string, anything else as base64."""
+    if content_type.startswith("application/json"):
+        try:
+            return {"id": request_id, "body": loads_json(body)}
+        except ValueError:
+            pass
+    if content_type.startswith(("text/", "application/json", "application/x-ndjson")):
+        return {"id": request_id, "text": body.decode("utf-8", errors="replace")}
+    return {"id": request_id, "body_b64": base64.b64encode(body).decode("ascii")}
+
+def encode_chunk(request_id, chunk: bytes, content_type: str, decoder, final: bool) -> dict:
+    """Encodes one piece of a streamed body; text is decoded incrementally so characters split across chunks survive."""
+    if content_type.startswith(("text/", "application/json", "application/x-ndjson")):
+        return {"id": request_id, "chunk": decoder.decode(chunk, final)}
+    return {"id": request_id, "chunk_b64": base64.b64encode(chunk).decode("ascii")}
+
+class RPCConnection:
+    """
+    Multiplexes concurrent API calls over one WebSocket. Every request frame is dispatched to the
+    app in-process as its own task, through the same middleware, authentication and handlers as HTTP,
+    and responses are sent back tagged with the request id in whatever order they complete.
+    """
+
+    def __init__(self, websocket: WebSocket, api_key: str):
+        self.websocket = websocket
+        self.api_key = api_key
+        self.app = get_app()
+        self.tasks = {}
+        self.send_lock = asyncio.Lock()
+        self.semaphore = asyncio.Semaphore(WS_MAX_CONCURRENCY)
+
+    async def send_frame(self, frame: dict):
+        data = dumps_json(frame).decode("utf-8")
+        async with self.send_lock:
+            await self.websocket.send_text(data)
+
+    async def run(self):
+        try:
+            while True:
+                try:
+                    message = loads_json(await self.websocket.receive_text())
+                except ValueError:
+                    await self.send_frame({"id": None, "status": 400, "error": "Frames must be JSON objects"})
+                    continue
+                request_id = message.get("id") if isinstance(message, dict) else None
+                if not isinstance(request_id, (str, int)) or isinstance(request_id, bool):
+                    await self.send_frame({"id": None, "status": 400, "error": "Frames need a string or integer 'id'"})
+                    continue
+                if not message.get("cancel") and not isinstance(message.get("path"), str):
+                    await self.send_frame({"id": request_id, "status": 400, "error": "Frames need a 'path'"})
+                    continue
+                if message.get("cancel"):
+                    task = self.tasks.get(request_id)
+                    if task:
+                        task.cancel()
+                    continue
+                if request_id in self.tasks:
+                    await self.send_frame({"id": request_id, "status": 409, "error": "Request id already in use"})
+                    continue
+                task = asyncio.create_task(self.dispatch(request_id, message))
+                self.tasks[request_id] = task
+                task.add_done_callback(lambda _, request_id=request_id: self.tasks.pop(request_id, None))
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in list(self.tasks.values()):
+                task.cancel()
+
+    async def dispatch(self, request_id, message: dict):
+        """
+        Runs one request against the app. Small bodies are answered with a single frame; large or
+        streamed bodies (e.g. /search) are sent as a start frame, chunk frames and a done frame.
+        """
+        try:
+            (scope, body) = build_scope(self.websocket, message, self.api_key)
+        except Exception as e:
+            await self.send_frame({"id": request_id, "status": 400, "error": f"Invalid request frame: {e}"})
+            return
+        disconnected = asyncio.Event()
+        request_sent = False
+        response = {"start": None, "streaming": False, "done": False, "content_type": ""}
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(event):
+            if event["type"] == "http.response.start":
+                headers = {name.decode("latin-1"): value.decode("latin-1") for (name, value) in event.get("headers", [])}
+                response["start"] = {"id": request_id, "status": event["status"], "headers": headers}
+                response["content_type"] = headers.get("content-type", "")
+                return
+            if event["type"] != "http.response.body":
+                return
+            chunk = event.get("body", b"")
+            more_body = event.get("more_body", False)
+            if not response["streaming"] and not more_body and len(chunk) <= WS_FRAME_SIZE:
+                response["done"] = True
+                await self.send_frame({**response["start"], **encode_body(request_id, chunk, response["content_type"])})
+                return
+            if not response["streaming"]:
+                response["streaming"] = True
+                await self.send_frame({**response["start"], "stream": True})
+            for offset in range(0, len(chunk), WS_FRAME_SIZE):
+                final = not more_body and offset + WS_FRAME_SIZE >= len(chunk)
+                await self.send_frame(encode_chunk(request_id, chunk[offset:offset + WS_FRAME_SIZE], response["content_type"], decoder, final))
+            if not more_body:
+                response["done"] = True
+                await self.send_frame({"id": request_id, "done": True})
+
+        async with self.semaphore:
+            try:
+                await self.app(scope, receive, send)
+            except asyncio.CancelledError:
+                disconnected.set()
+                try:
+                    await self.send_frame({"id": request_id, "cancelled": True})
+                except Exception:
+                    pass  # the socket is already gone
+                raise
+            except Exception as e:
+                logger.error(f"WebSocket request {request_id} to {scope['path']} failed: {e}")
+                if response["done"]:
+                    return
+                frame = {"id": request_id, "error": str(e), "done": True} if response["streaming"] else {"id": request_id, "status": 500, "error": str(e)}
+                try:
+                    await self.send_frame(frame)
+                except Exception:
+                    pass  # the socket is already gone
+
+@router.websocket("/ws")
+async def websocket_rpc(websocket: WebSocket):
+    """
+    Authenticated WebSocket that multiplexes API calls over a single connection.
+    Send {"id": ..., "method": "POST", "path": "/run-command", "body": {...}} frames (optionally with
+    "query", "headers" or a base64 "body_b64"); responses carry the same id and may arrive out of order.
+    Send {"id": ..., "cancel": true} to abort an in-flight request.
+    """
+    api_key = await authenticate_websocket(websocket)
+    if api_key is None:
+        return
+    await websocket.accept()
+    logger.info(f"WebSocket RPC connection opened from {websocket.client}")
+    await RPCConnection(websocket, api_key).run()
+    logger.info(f"WebSocket RPC connection closed from {websocket.client}")
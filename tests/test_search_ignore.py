@@ -0,0 +1,89 @@
+import asyncio
+import os
+from search import IgnoreRule, SearchJob, compile_pattern, is_ignored, load_ancestor_gitignores, parse_ignore_patterns
+
+ROOT = os.path.join(os.sep, 'r')
+
+def path(*parts):
+    return os.path.join(ROOT, *parts)
+
+def test_unanchored_pattern_matches_at_any_depth():
+    rule = IgnoreRule(ROOT, '*.log')
+    assert rule.matches(path('a.log'), False)
+    assert rule.matches(path('src', 'deep', 'a.log'), False)
+    assert not rule.matches(path('a.txt'), False)
+
+def test_leading_slash_anchors_to_base_dir():
+    rule = IgnoreRule(ROOT, '/build')
+    assert rule.matches(path('build'), True)
+    assert not rule.matches(path('src', 'build'), True)
+
+def test_anchored_dir_only_pattern():
+    rules = parse_ignore_patterns(ROOT, ['/build/'])
+    assert is_ignored(rules, path('build'), True)
+    assert is_ignored(rules, path('build', 'out.o'), False)
+    assert not is_ignored(rules, path('src', 'build'), True)
+    assert not is_ignored(rules, path('src', 'build', 'out.o'), False)
+
+def test_unanchored_dir_only_pattern():
+    rules = parse_ignore_patterns(ROOT, ['build/'])
+    assert is_ignored(rules, path('src', 'build'), True)
+    assert is_ignored(rules, path('src', 'build', 'out.o'), False)
+    assert not is_ignored(rules, path('build'), False)
+
+def test_middle_slash_anchors():
+    rules = parse_ignore_patterns(ROOT, ['docs/*.md'])
+    assert is_ignored(rules, path('docs', 'a.md'), False)
+    assert not is_ignored(rules, path('src', 'docs', 'a.md'), False)
+
+def test_double_star():
+    rules = parse_ignore_patterns(ROOT, ['**/cache/**'])
+    assert is_ignored(rules, path('cache', 'x'), False)
+    assert is_ignored(rules, path('a', 'b', 'cache', 'x', 'y'), False)
+
+def test_negation_and_last_match_wins():
+    rules = parse_ignore_patterns(ROOT, ['*.log', '!keep.log'])
+    assert is_ignored(rules, path('a.log'), False)
+    assert not is_ignored(rules, path('keep.log'), False)
+    rules = parse_ignore_patterns(ROOT, ['!keep.log', '*.log'])
+    assert is_ignored(rules, path('keep.log'), False)
+
+def test_comments_and_blank_lines_are_skipped():
+    assert parse_ignore_patterns(ROOT, ['# comment\n', '\n', '   \n']) == []
+
+def test_rules_only_apply_below_their_directory():
+    rules = parse_ignore_patterns(path('sub'), ['*.log'])
+    assert is_ignored(rules, path('sub', 'a.log'), False)
+    assert not is_ignored(rules, path('a.log'), False)
+
+def make_repository(tmp_path):
+    (tmp_path / '.git').mkdir()
+    (tmp_path / '.gitignore').write_text('*.log\n')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / '.gitignore').write_text('!keep.log\n')
+    (tmp_path / 'sub' / 'deeper').mkdir()
+    for name in ('a.log', 'keep.log', 'a.txt'):
+        (tmp_path / 'sub' / 'deeper' / name).write_text('needle\n')
+    return tmp_path
+
+def test_ancestor_gitignores_load_outermost_first(tmp_path):
+    repository = make_repository(tmp_path)
+    deeper = str(repository / 'sub' / 'deeper')
+    rules = load_ancestor_gitignores(deeper)
+    assert [rule.base_dir for rule in rules] == [str(repository), str(repository / 'sub')]
+    assert is_ignored(rules, os.path.join(deeper, 'a.log'), False)
+    assert not is_ignored(rules, os.path.join(deeper, 'keep.log'), False)
+
+def test_no_ancestor_rules_at_repository_root_or_outside_a_repository(tmp_path):
+    assert load_ancestor_gitignores(str(make_repository(tmp_path))) == []
+    assert load_ancestor_gitignores(os.path.abspath(os.sep)) == []
+
+async def search_names(root):
+    job = SearchJob(root, compile_pattern('needle'))
+    return sorted([os.path.basename(result['path']) async for result in job.results()])
+
+def test_searching_a_subdirectory_honours_ancestor_gitignores(tmp_path):
+    repository = make_repository(tmp_path)
+    expected = ['a.txt', 'keep.log']
+    assert asyncio.run(search_names(str(repository))) == expected
+    assert asyncio.run(search_names(str(repository / 'sub' / 'deeper'))) == expected